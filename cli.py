@@ -3,7 +3,7 @@
 Example usage:
 $ python -O cli.py --nodes 4 --partitions 2 --rounds 4 --workers 16 -dryrun
 """
-from generator import Generator
+from generator import Generator, Symmetry
 import argparse
 import logging
 import multiprocessing
@@ -51,6 +51,54 @@ if __name__ == '__main__':
         type=int,
         default=1
     )
+    parser.add_argument(
+        '--ordering',
+        help='the order of the testcases (default "lexicographic")',
+        choices=Generator.ORDERINGS,
+        default='lexicographic'
+    )
+    parser.add_argument(
+        '--symmetry',
+        help='only generate one testcase of each class of testcases that '
+        'are equivalent under these relabelings of the nodes',
+        choices=Symmetry.GROUPS,
+        nargs='+',
+        default=[]
+    )
+    parser.add_argument(
+        '--filter',
+        help='only print the testcases accepted by this filter expression, '
+        'eg. "rounds.any(leader_isolated) & (rounds.count(quorum) <= 2)"'
+    )
+    parser.add_argument(
+        '--sample',
+        help='only print this number of testcases drawn uniformly at random',
+        type=int
+    )
+    parser.add_argument(
+        '--seed',
+        help='the seed used to draw the testcases (default "0")',
+        type=int,
+        default=0
+    )
+    parser.add_argument(
+        '--sampling',
+        help='how to draw the sampled testcases (default "uniform")',
+        choices=Generator.SAMPLINGS,
+        default='uniform'
+    )
+    parser.add_argument(
+        '--estimate',
+        help='only estimate the number of printed testcases and the size of '
+        'the output from this number of sampled testcases',
+        type=int
+    )
+    parser.add_argument(
+        '--format',
+        help='the format of the printed files (default "json")',
+        choices=list(Generator.FORMATS),
+        default='json'
+    )
     parser.add_argument(
         '-v',
         dest='verb',
@@ -86,6 +134,14 @@ if __name__ == '__main__':
         parser.error(
             'argument "workers" must be strictly positif'
         )
+    if args.estimate is not None and args.estimate <= 0:
+        parser.error(
+            'argument "estimate" must be strictly positif'
+        )
+    if args.sample is not None and args.sample < 0:
+        parser.error(
+            'argument "sample" must be positif'
+        )
 
     # Apply settings and run the generator
     logging.basicConfig(
@@ -93,17 +149,36 @@ if __name__ == '__main__':
         format="[%(levelname)s] %(asctime)s: %(message)s"
     )
 
-    generator = Generator(
-        args.nodes,
-        args.partitions,
-        args.rounds,
-        filter=None,
-        folder_path=args.path,
-        machine_index=args.index,
-        number_of_machines=args.machines
-    )
-    generator.run(
-        workers=args.workers,
-        dryrun=args.dryrun,
-        testcases_per_file=args.testcases_per_file
-    )
+    # Invalid filter expressions and samples are only detected by the
+    # generator.
+    try:
+        generator = Generator(
+            args.nodes,
+            args.partitions,
+            args.rounds,
+            filter=args.filter,
+            folder_path=args.path,
+            machine_index=args.index,
+            number_of_machines=args.machines,
+            ordering=args.ordering,
+            symmetry=args.symmetry,
+            output_format=args.format
+        )
+        if args.estimate is not None:
+            generator.estimate_selectivity(
+                args.estimate,
+                seed=args.seed,
+                testcases_per_file=args.testcases_per_file,
+                workers=args.workers
+            )
+        else:
+            generator.run(
+                workers=args.workers,
+                dryrun=args.dryrun,
+                testcases_per_file=args.testcases_per_file,
+                sample=args.sample,
+                seed=args.seed,
+                sampling=args.sampling
+            )
+    except ValueError as e:
+        parser.error(str(e))
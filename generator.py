@@ -1,327 +1,3773 @@
 import logging
-from itertools import product
-from more_itertools import ichunked, distribute
-from os.path import join
-from copy import deepcopy
-from math import factorial as f
-from multiprocessing import Process
-from tempfile import TemporaryDirectory
+import ast
+import operator
+from random import Random
+from itertools import product, compress, permutations, groupby, \
+    chain, islice
+from os import makedirs, replace
+from os.path import join, dirname, getsize, isfile
+from re import sub
+from math import factorial as f, sqrt, prod
+from multiprocessing import Process, Queue
+from hashlib import blake2b
+from heapq import heappush, heappushpop, nsmallest
+from tempfile import TemporaryDirectory, NamedTemporaryFile
 from contextlib import nullcontext
-from json import dumps
+from io import StringIO, BytesIO
+from json import dumps, load
+from array import array
+from struct import Struct
+from mmap import mmap, ACCESS_READ
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is only required by the batch engine.
+    np = None
 
 
 class JSONFormat:
+    MODE = 'a'
+    FILES = 1
+
+    @classmethod
+    def make(cls, generator, testcases, filter):
+        """ Defines the format used to print testcases to files.
+
+        This format needs to be understood by the Twins Executor. When the
+        generator has a symmetry, each scenario also holds the number of
+        equivalent testcases it stands for ('multiplicity'). The json of
+        the leaders and of the partition of each scenario is rendered once
+        and reused by all the testcases using that scenario.
+
+        Args:
+            generator (Generator): The generator instance.
+            testcases (iterable): The testcases to print, encoded as tuples
+                of scenario indices.
+            filter (Object): A filter used to filter testcases before
+                printing them to file. It receives decoded testcases.
+
+        Returns:
+            str: A formatted json string ready to be printed to file.
+        """
+        data = StringIO()
+        cls.write(generator, testcases, filter, data)
+        return data.getvalue()
+
+    @classmethod
+    def write(cls, generator, testcases, filter, file):
+        """ Print testcases to a file in the format of `make`, one testcase
+        at a time, so that the testcases are never all held in memory.
+
+        Args:
+            generator (Generator): The generator instance.
+            testcases (iterable): The testcases to print, encoded as tuples
+                of scenario indices.
+            filter (Object): A filter used to filter testcases before
+                printing them to file. It receives decoded testcases.
+            file (file): The file where to print the testcases.
+        """
+        if filter is not bool:
+            testcases = (
+                x for x in testcases if filter(generator._decode(x))
+            )
+        file.write(cls._header(generator))
+        separator = ''
+        for testcase in testcases:
+            file.write(separator)
+            file.write(cls._format_testcase(generator, testcase))
+            separator = ', '
+        file.write(']}')
+
+    @classmethod
+    def sizes(cls, generator, testcases):
+        """ Measure the size of the files printed in this format, from
+        some of the testcases they hold (see
+        `Generator.estimate_selectivity`).
+
+        Args:
+            generator (Generator): The generator instance.
+            testcases (list): Testcases, encoded as tuples of scenario
+                indices.
+
+        Returns:
+            tuple: The number of bytes of each file without its testcases,
+                and the average number of bytes of a testcase (0 if there
+                are no testcases).
+        """
+        header = len(cls.make(generator, [], bool))
+        if not testcases:
+            return header, 0
+        body = len(cls.make(generator, testcases, bool)) - header
+        # Testcases are separated by ', ' in the list of each file.
+        return header - 2, (body + 2) / len(testcases)
+
+    @classmethod
+    def _header(cls, generator):
+        return (
+            f'{{"num_of_nodes": {generator.number_of_nodes}, '
+            f'"num_of_twins": {generator.f}, "scenarios": ['
+        )
+
+    @classmethod
+    def _format_testcase(cls, generator, testcase):
+        """ Format a single testcase, assembling the json fragments of its
+        scenarios (see `Generator._fragment`).
+
+        Args:
+            generator (Generator): The generator instance.
+            testcase (tuple(int)): The index of the scenario of each round.
+
+        Returns:
+            str: The testcase as a json object.
+        """
+        fragments = [generator._fragment(x) for x in testcase]
+        leaders = ', '.join(
+            f'"{i+1}": {x}' for i, (x, _) in enumerate(fragments)
+        )
+        partitions = ', '.join(
+            f'"{i+1}": {x}' for i, (_, x) in enumerate(fragments)
+        )
+        extra = ''.join(
+            f', {dumps(key)}: {dumps(value)}'
+            for key, value in generator._annotations(testcase).items()
+        )
+        return (
+            f'{{"round_leaders": {{{leaders}}}, '
+            f'"round_partitions": {{{partitions}}}{extra}}}'
+        )
+
+
+class TableFormat(JSONFormat):
+    """ A compact variant of `JSONFormat`, where the partitions and the
+    leaders are listed once per corpus in a table (the file
+    'partitions.json', see `write_table`), and each round of a testcase only
+    holds the index of its leaders and of its partition in the table. The
+    Twins Executor reads these files with `decode`.
+    """
+    TABLE = 'partitions.json'
+
+    @classmethod
+    def write_table(cls, generator):
+        """ Print the table of the partitions and of the leaders to the
+        directory of the generator. The file is written under a temporary
+        name and then renamed, so that it is never read partially.
+
+        Args:
+            generator (Generator): The generator instance.
+        """
+        path = join(generator.folder_path, cls.TABLE)
+        with NamedTemporaryFile(
+            'w', dir=generator.folder_path, delete=False
+        ) as f:
+            cls._write_table(generator, f)
+        replace(f.name, path)
+
+    @classmethod
+    def make_table(cls, generator):
+        """ Defines the table printed by `write_table`.
+
+        Args:
+            generator (Generator): The generator instance.
+
+        Returns:
+            str: The table as a json string.
+        """
+        data = StringIO()
+        cls._write_table(generator, data)
+        return data.getvalue()
+
+    @classmethod
+    def _write_table(cls, generator, file):
+        leaders = ', '.join(
+            generator._fragment(x)[0]
+            for x in range(len(generator.target_nodes))
+        )
+        file.write(
+            f'{{"num_of_nodes": {generator.number_of_nodes}, '
+            f'"num_of_twins": {generator.f}, "leaders": [{leaders}], '
+            '"partitions": ['
+        )
+        separator = ''
+        for partition in generator.iter_partitions():
+            file.write(separator)
+            file.write(dumps(partition))
+            separator = ', '
+        file.write(']}')
+
+    @classmethod
+    def decode(cls, path, table=None):
+        """ Read a file printed in this format.
+
+        Args:
+            path (str): The path of the file.
+            table (dict, optional): The table of the corpus, if already read.
+                Defaults to None (read from the directory of the file).
+
+        Returns:
+            dict: The content of the file, as if it had been printed with
+                `JSONFormat`.
+        """
+        with open(path) as f:
+            data = load(f)
+        if table is None:
+            with open(join(dirname(path), data['table'])) as f:
+                table = load(f)
+        scenarios = []
+        for scenario in data['scenarios']:
+            leaders = scenario.pop('leaders')
+            partitions = scenario.pop('partitions')
+            decoded = {
+                'round_leaders': {
+                    str(i+1): table['leaders'][x]
+                    for i, x in enumerate(leaders)
+                },
+                'round_partitions': {
+                    str(i+1): table['partitions'][x]
+                    for i, x in enumerate(partitions)
+                }
+            }
+            decoded.update(scenario)
+            scenarios += [decoded]
+        return {
+            'num_of_nodes': data['num_of_nodes'],
+            'num_of_twins': data['num_of_twins'],
+            'scenarios': scenarios
+        }
+
+    @classmethod
+    def _header(cls, generator):
+        return (
+            f'{{"num_of_nodes": {generator.number_of_nodes}, '
+            f'"num_of_twins": {generator.f}, "table": "{cls.TABLE}", '
+            '"scenarios": ['
+        )
+
+    @classmethod
+    def _format_testcase(cls, generator, testcase):
+        partitions, leaders = zip(
+            *(divmod(x, len(generator.target_nodes)) for x in testcase)
+        )
+        extra = ''.join(
+            f', {dumps(key)}: {dumps(value)}'
+            for key, value in generator._annotations(testcase).items()
+        )
+        return (
+            f'{{"leaders": [{", ".join(map(str, leaders))}], '
+            f'"partitions": [{", ".join(map(str, partitions))}]{extra}}}'
+        )
+
+
+class BinaryFormat:
+    """ A binary format, where each testcase is a fixed-width record holding
+    the index of the scenario of each round (see `Generator.encode`), as
+    little-endian unsigned integers of 2, 4 or 8 bytes. The records follow a
+    header describing the generator that printed them (see `HEADER`), and
+    are read with `BinaryReader`. Annotations such as the multiplicity of
+    the testcases are not printed (see `Generator.multiplicity`).
+    """
+    MODE = 'ab'
+    FILES = 1
+    MAGIC = b'TWIN'
+    VERSION = 1
+    # Magic, version, record width, nodes, partitions, rounds, twins and
+    # ordering, padded to 16 bytes.
+    HEADER = Struct('<4sBBHHHHBx')
+    WIDTHS = {2: 'H', 4: 'I', 8: 'Q'}
+
+    @classmethod
+    def make(cls, generator, testcases, filter):
+        """ Defines the binary format used to print testcases to files.
+
+        Args:
+            generator (Generator): The generator instance.
+            testcases (iterable): The testcases to print, encoded as tuples
+                of scenario indices.
+            filter (Object): A filter used to filter testcases before
+                printing them to file. It receives decoded testcases.
+
+        Returns:
+            bytes: The header followed by the records of the testcases.
+        """
+        data = BytesIO()
+        cls.write(generator, testcases, filter, data)
+        return data.getvalue()
+
+    @classmethod
+    def write(cls, generator, testcases, filter, file):
+        """ Print testcases to a file in the format of `make`, one testcase
+        at a time.
+
+        Args:
+            generator (Generator): The generator instance.
+            testcases (iterable): The testcases to print, encoded as tuples
+                of scenario indices.
+            filter (Object): A filter used to filter testcases before
+                printing them to file. It receives decoded testcases.
+            file (file): The file where to print the testcases, opened in
+                binary mode.
+        """
+        if filter is not bool:
+            testcases = (
+                x for x in testcases if filter(generator._decode(x))
+            )
+        width = cls.width(generator.scenarios_length)
+        file.write(cls.HEADER.pack(
+            cls.MAGIC, cls.VERSION, width, generator.number_of_nodes,
+            generator.number_of_partitions, generator.number_of_rounds,
+            generator.f, generator.ORDERINGS.index(generator.ordering)
+        ))
+        record = cls.record(width, generator.number_of_rounds)
+        for testcase in testcases:
+            file.write(record.pack(*testcase))
+
+    @classmethod
+    def sizes(cls, generator, testcases):
+        """ The size of the files printed in this format (see
+        `JSONFormat.sizes`). Records have a fixed width, so the testcases
+        are not needed.
+
+        Args:
+            generator (Generator): The generator instance.
+            testcases (list): Testcases, encoded as tuples of scenario
+                indices.
+
+        Returns:
+            tuple: The number of bytes of the header and of a record.
+        """
+        width = cls.width(generator.scenarios_length)
+        record = cls.record(width, generator.number_of_rounds)
+        return cls.HEADER.size, record.size
+
+    @classmethod
+    def width(cls, scenarios_length):
+        """ The number of bytes of the smallest unsigned integer that can
+        hold any scenario index.
+
+        Args:
+            scenarios_length (int): The number of scenarios.
+
+        Returns:
+            int: The number of bytes.
+        """
+        return next(
+            x for x in sorted(cls.WIDTHS) if scenarios_length <= 1 << 8 * x
+        )
+
+    @classmethod
+    def record(cls, width, number_of_rounds):
+        return Struct(f'<{number_of_rounds}{cls.WIDTHS[width]}')
+
+
+class NpyFormat:
+    """ A columnar format for analysis pipelines, where each file is a pair
+    of NumPy arrays: the matrix of the scenario indices of the testcases
+    (see `Generator.scenario_matrix`), of shape (testcases, rounds), and
+    the positions of the testcases (see `Generator.index_of`). The arrays
+    are written straight from the batch engine (see `Generator._shard`),
+    and `load` maps them in memory. This requires NumPy.
+    """
+    INDEX = '-index'
+    # The number of files printed for each chunk of testcases.
+    FILES = 2
+
     @classmethod
     def make(cls, generator, testcases, filter):
         """ Defines the format used to print testcases to files.
 
-        This format needs to be understood by the Twins Executor.
+        Args:
+            generator (Generator): The generator instance.
+            testcases (iterable): The testcases to print, encoded as tuples
+                of scenario indices.
+            filter (Object): A filter used to filter testcases before
+                printing them to file. It receives decoded testcases.
+
+        Returns:
+            bytes: The two arrays, in the `.npy` format.
+        """
+        if filter is not bool:
+            testcases = (
+                x for x in testcases if filter(generator._decode(x))
+            )
+        testcases = list(testcases)
+        matrix = np.array(testcases, dtype=generator.scenario_dtype)
+        matrix = matrix.reshape(-1, generator.number_of_rounds)
+        positions = np.array(
+            [generator._position(x) for x in testcases], dtype=np.uint64
+        )
+        data = BytesIO()
+        np.save(data, matrix)
+        np.save(data, positions)
+        return data.getvalue()
+
+    @classmethod
+    def sizes(cls, generator, testcases):
+        """ Measure the size of the files printed in this format (see
+        `JSONFormat.sizes`). Both files of a chunk are counted.
+
+        Args:
+            generator (Generator): The generator instance.
+            testcases (list): Testcases, encoded as tuples of scenario
+                indices.
+
+        Returns:
+            tuple: The number of bytes of the headers of the two arrays,
+                and the number of bytes of a testcase in the two arrays.
+        """
+        header = len(cls.make(generator, [], bool))
+        if not testcases:
+            return header, 0
+        body = len(cls.make(generator, testcases, bool)) - header
+        return header, body / len(testcases)
+
+    @classmethod
+    def save(cls, path, matrix, positions):
+        """ Print testcases to files.
+
+        Args:
+            path (str): The path of the file of the scenario indices, without
+                the extension '.npy'. The positions are printed to the same
+                path, followed by '-index.npy'.
+            matrix (numpy.ndarray): The scenario indices of the testcases.
+            positions (numpy.ndarray): The positions of the testcases.
+        """
+        np.save(f'{path}.npy', matrix)
+        np.save(f'{path}{cls.INDEX}.npy', positions)
+
+    @classmethod
+    def load(cls, path):
+        """ Map the files printed by `save` in memory.
+
+        Args:
+            path (str): The path given to `save`.
+
+        Returns:
+            tuple(numpy.ndarray): The scenario indices and the positions of
+                the testcases.
+        """
+        return (
+            np.load(f'{path}.npy', mmap_mode='r'),
+            np.load(f'{path}{cls.INDEX}.npy', mmap_mode='r')
+        )
+
+
+class BinaryReader:
+    """ Read a file printed with `BinaryFormat`. The file is mapped in
+    memory, and any record can be read in constant time without reading
+    the records before it:
+
+        with BinaryReader(path) as reader:
+            testcase = reader[i]  # The scenario index of each round.
+    """
+    def __init__(self, path):
+        """ Open a file.
+
+        Args:
+            path (str): The path of the file.
+
+        Raises:
+            ValueError: Raised upon invalid files.
+        """
+        self._file = open(path, 'rb')
+        try:
+            self._data = mmap(self._file.fileno(), 0, access=ACCESS_READ)
+        except (ValueError, OSError):  # Empty files cannot be mapped.
+            self._file.close()
+            raise ValueError(f'Invalid binary testcases file: {path}.')
+        header = BinaryFormat.HEADER
+        ok = len(self._data) >= header.size
+        if ok:
+            magic, version, width, n, k, r, f, ordering = header.unpack_from(
+                self._data
+            )
+            ok = magic == BinaryFormat.MAGIC
+            ok &= version == BinaryFormat.VERSION
+            ok &= width in BinaryFormat.WIDTHS
+        if not ok:
+            self.close()
+            raise ValueError(f'Invalid binary testcases file: {path}.')
+        self.number_of_nodes = n
+        self.number_of_partitions = k
+        self.number_of_rounds = r
+        self.f = f
+        self.ordering = Generator.ORDERINGS[ordering]
+        self._record = BinaryFormat.record(width, r)
+        self._generator = None
+
+    def __len__(self):
+        size = len(self._data) - BinaryFormat.HEADER.size
+        return size // self._record.size
+
+    def __getitem__(self, index):
+        """ Read a record.
+
+        Args:
+            index (int): The index of the record in the file.
+
+        Returns:
+            tuple(int): The index of the scenario of each round.
+
+        Raises:
+            IndexError: Raised upon invalid indices.
+        """
+        if not -len(self) <= index < len(self):
+            raise IndexError(f'Record {index} out of range.')
+        index %= len(self)
+        offset = BinaryFormat.HEADER.size + index * self._record.size
+        return self._record.unpack_from(self._data, offset)
+
+    def __iter__(self):
+        size, start = self._record.size, BinaryFormat.HEADER.size
+        for offset in range(start, start + len(self) * size, size):
+            yield self._record.unpack_from(self._data, offset)
+
+    def decode(self, index):
+        """ Read a record and decode it (see `Generator.decode`).
+
+        Args:
+            index (int): The index of the record in the file.
+
+        Returns:
+            tuple: A tuple of (leader, partition), one per round.
+        """
+        if self._generator is None:
+            self._generator = Generator(
+                self.number_of_nodes, self.number_of_partitions,
+                self.number_of_rounds, ordering=self.ordering
+            )
+        return self._generator._decode(self[index])
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class Filter:
+    """ A filter selecting the testcases to print, round after round.
+
+    The generator calls `accept_prefix` on the first rounds of the testcases
+    it generates, one more round at a time. As soon as the first rounds of a
+    testcase are rejected, all the testcases starting with the same rounds
+    are skipped without being generated. Subclasses override `accept_prefix`,
+    or `accept_ids` to work on scenario indices (see
+    `Generator.scenario_features`); a testcase is printed if all its prefixes
+    (including the testcase itself) are accepted. Calling a filter on a
+    decoded testcase checks its prefixes with `accept_prefix`, so filters
+    that only override `accept_ids` cannot be called.
+    """
+
+    def accept_prefix(self, rounds):
+        """ Check the first rounds of a testcase.
+
+        Args:
+            rounds (tuple): The (leader, partition) scenario of each of the
+                first rounds of the testcase.
+
+        Returns:
+            bool: Whether testcases starting with these rounds may be printed.
+        """
+        return True
+
+    def accept_ids(self, generator, rounds):
+        """ Same as `accept_prefix`, but the first rounds of the testcase are
+        encoded as scenario indices (see `Generator.encode`).
+
+        Args:
+            generator (Generator): The generator instance.
+            rounds (tuple(int)): The index of the scenario of each of the
+                first rounds of the testcase.
+
+        Returns:
+            bool: Whether testcases starting with these rounds may be printed.
+        """
+        return self.accept_prefix(generator._decode(rounds))
+
+    def __call__(self, testcase):
+        cls = type(self)
+        if cls.accept_prefix is Filter.accept_prefix \
+                and cls.accept_ids is not Filter.accept_ids:
+            raise TypeError(
+                f'{cls.__name__} only checks scenario indices (accept_ids), '
+                'and needs a generator to check a testcase.'
+            )
+        return all(
+            self.accept_prefix(tuple(testcase[:i+1]))
+            for i in range(len(testcase))
+        )
+
+
+class RoundFilter(Filter):
+    """ A filter made of a predicate on the scenario of each round and a
+    predicate on the scenarios of each pair of consecutive rounds.
+
+    The number of testcases accepted by such a filter only depends on which
+    scenarios may follow which, so the generator counts them exactly without
+    generating them (see `Generator.filtered_length`), and splits the
+    accepted testcases evenly across machines and processes.
+
+    The predicate on each round is only evaluated once per scenario (see
+    `Generator.round_verdicts`). When the filter has a name, its verdicts can
+    be kept on disk and reused by later runs.
+    """
+
+    def __init__(self, round_predicate=None, transition_predicate=None,
+                 name=None, version=0):
+        """ Instantiate the filter.
+
+        Args:
+            round_predicate (callable, optional): Whether the (leader,
+                partition) scenario of a round is accepted. Defaults to None
+                (all scenarios are accepted).
+            transition_predicate (callable, optional): Whether the scenario of
+                a round (second argument) may follow the scenario of the
+                previous round (first argument). Defaults to None (all
+                transitions are accepted).
+            name (str, optional): The name of the predicate on each round, used
+                to cache its verdicts on disk. Defaults to None (the verdicts
+                are not cached on disk).
+            version (int, optional): The version of the predicate on each
+                round; changing the predicate requires changing its name or
+                its version. Defaults to 0.
+        """
+        self.round_predicate = round_predicate
+        self.transition_predicate = transition_predicate
+        self.name = name
+        self.version = version
+
+    def accept_round(self, scenario):
+        """ Check the scenario of a round.
+
+        Args:
+            scenario (tuple): A (leader, partition) scenario.
+
+        Returns:
+            bool: Whether the scenario is accepted.
+        """
+        return self.round_predicate is None or self.round_predicate(scenario)
+
+    def accept_transition(self, previous, scenario):
+        """ Check the scenarios of two consecutive rounds.
+
+        Args:
+            previous (tuple): The (leader, partition) scenario of a round.
+            scenario (tuple): The scenario of the next round.
+
+        Returns:
+            bool: Whether the scenario may follow the previous one.
+        """
+        return self.transition_predicate is None \
+            or self.transition_predicate(previous, scenario)
+
+    def accept_prefix(self, rounds):
+        if not self.accept_round(rounds[-1]):
+            return False
+        return len(rounds) < 2 or self.accept_transition(*rounds[-2:])
+
+    def accept_ids(self, generator, rounds):
+        if not generator.round_verdicts[rounds[-1]]:
+            return False
+        if len(rounds) < 2 or self.transition_predicate is None:
+            return True
+        return self.accept_transition(
+            generator._scenario(rounds[-2]), generator._scenario(rounds[-1])
+        )
+
+
+class FeatureFilter(Filter):
+    """ A filter on the features of the scenario of each round (see
+    `Generator.scenario_features`). It only checks bitmasks, and never
+    decodes scenarios.
+    """
+
+    def __init__(self, required=(), forbidden=()):
+        """ Instantiate the filter.
+
+        Args:
+            required (list(str), optional): The features that the scenario of
+                every round needs to have. Defaults to ().
+            forbidden (list(str), optional): The features that the scenario of
+                no round may have. Defaults to ().
+        """
+        self.required = Generator.feature_mask(*required)
+        self.forbidden = Generator.feature_mask(*forbidden)
+
+    def accept_ids(self, generator, rounds):
+        features = generator.scenario_features[rounds[-1]]
+        return features & self.required == self.required \
+            and not features & self.forbidden
+
+
+class Expression:
+    """ An expression of the filter language, evaluated with NumPy on whole
+    batches of testcases at once.
+
+    The terms of the language are the features of the scenarios (see
+    `Generator.scenario_features`), evaluated on every round at once:
+    `Expression.feature('leader_isolated')` is a boolean per round, and
+    `Expression.feature('leader_block_size')` the size of the block of the
+    leader in each round. `rounds.any`, `rounds.all`, `rounds.count` and
+    `rounds.at` reduce them to one value per testcase. Expressions are
+    combined with `&`, `|`, `~` and compared with `<`, `<=`, `==`, `!=`,
+    `>=`, `>`. Since `&` and `|` take precedence over comparisons in Python,
+    comparisons need parentheses, eg.
+    `rounds.any(leader_isolated) & (rounds.count(quorum) <= 2)`.
+    An expression that still has one value per round accepts a testcase if
+    it holds in every round. The generator accepts an expression (or its
+    text, see `parse`) as filter; this requires NumPy.
+    """
+
+    def __init__(self, function, text):
+        """ Instantiate the expression.
+
+        Args:
+            function (callable): Computes the value of the expression from the
+                matrix of the feature bitmasks of a batch of testcases, of
+                shape (testcases, rounds).
+            text (str): The text of the expression.
+        """
+        self.function = function
+        self.text = text
+
+    @classmethod
+    def feature(cls, name):
+        """ Get the term of a feature.
+
+        Args:
+            name (str): The name of the feature (see `Generator.FEATURES`), or
+                'leader_block_size'.
+
+        Returns:
+            Expression: The value of the feature in each round.
+
+        Raises:
+            ValueError: Raised upon unknown features.
+        """
+        if name == 'leader_block_size':
+            shift = Generator.LEADER_BLOCK_SHIFT
+            return cls(lambda x: x >> shift, name)
+        mask = Generator.feature_mask(name)
+        return cls(lambda x: x & mask != 0, name)
+
+    OPERATORS = {
+        ast.BitAnd: operator.and_, ast.BitOr: operator.or_,
+        ast.Lt: operator.lt, ast.LtE: operator.le, ast.Eq: operator.eq,
+        ast.NotEq: operator.ne, ast.GtE: operator.ge, ast.Gt: operator.gt
+    }
+    REDUCTIONS = ('any', 'all', 'count', 'at')
+
+    @classmethod
+    def parse(cls, text):
+        """ Compile the text of an expression. The text is parsed into a
+        syntax tree, and only the constructs of the language are compiled:
+        names of features, calls to the reductions of `rounds`, `&`, `|`,
+        `~`, single comparisons and integers, and the types of their
+        operands are checked (see `_compile`). The text is never evaluated.
+
+        Args:
+            text (str): The expression, where features are referred to by
+                their names, eg. 'rounds.any(leader_isolated)'.
+
+        Returns:
+            Expression: The expression.
+
+        Raises:
+            ValueError: Raised upon invalid expressions.
+        """
+        try:
+            tree = ast.parse(text, mode='eval')
+            expression, kind = cls._compile(tree.body)
+        except (SyntaxError, ValueError, TypeError) as e:
+            raise ValueError(f'Invalid filter expression: {text} ({e}).')
+        if not isinstance(expression, cls) or kind is not bool:
+            raise ValueError(
+                f'Invalid filter expression: {text} (not a condition).'
+            )
+        return expression
+
+    PARENTHESES = (
+        'add parentheses around comparisons, eg. '
+        'rounds.any(leader_isolated) & (rounds.count(quorum) <= 2)'
+    )
+
+    @classmethod
+    def _compile(cls, node):
+        """ Compile a node of the syntax tree of an expression, and check
+        the type of its operands: `&`, `|`, `~`, `rounds.any`, `rounds.all`
+        and `rounds.count` apply to conditions, and comparisons to integers.
+
+        Args:
+            node (ast.AST): The node.
+
+        Returns:
+            tuple: The value of the node (Expression or int), and its type
+                (bool for conditions, int for integers).
+
+        Raises:
+            ValueError: Raised upon constructs outside of the language, or
+                operands of the wrong type.
+        """
+        if isinstance(node, ast.Name):
+            if node.id not in Generator.FEATURES + ('leader_block_size',):
+                raise ValueError(f'unknown feature {node.id}')
+            kind = int if node.id == 'leader_block_size' else bool
+            return cls.feature(node.id), kind
+        if isinstance(node, ast.Constant) and type(node.value) is int:
+            return node.value, int
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) \
+                and isinstance(node.operand, ast.Constant) \
+                and type(node.operand.value) is int:
+            return -node.operand.value, int
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Invert):
+            operand = cls._condition(node.operand, '~')
+            return ~operand, bool
+        if isinstance(node, ast.BinOp) and type(node.op) in cls.OPERATORS:
+            symbol = '&' if isinstance(node.op, ast.BitAnd) else '|'
+            left = cls._condition(node.left, symbol)
+            right = cls._condition(node.right, symbol)
+            return cls.OPERATORS[type(node.op)](left, right), bool
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 \
+                and type(node.ops[0]) in cls.OPERATORS:
+            (left, left_kind), (right, right_kind) = map(
+                cls._compile, (node.left, node.comparators[0])
+            )
+            if left_kind is not int or right_kind is not int:
+                raise ValueError(
+                    f'comparisons apply to integers; {cls.PARENTHESES}'
+                )
+            return cls.OPERATORS[type(node.ops[0])](left, right), bool
+        if isinstance(node, ast.Call) and not node.keywords:
+            function = node.func
+            ok = isinstance(function, ast.Attribute)
+            ok = ok and isinstance(function.value, ast.Name)
+            ok = ok and function.value.id == 'rounds'
+            ok = ok and function.attr in cls.REDUCTIONS
+            if ok and function.attr == 'at' and len(node.args) == 2:
+                index, expression = map(cls._compile, node.args)
+                return rounds.at(index[0], expression[0]), expression[1]
+            if ok and len(node.args) == 1:
+                name = f'rounds.{function.attr}'
+                expression = cls._condition(node.args[0], name)
+                reduction = getattr(rounds, function.attr)(expression)
+                return reduction, int if function.attr == 'count' else bool
+        raise ValueError(f'unsupported syntax {type(node).__name__}')
+
+    @classmethod
+    def _condition(cls, node, symbol):
+        """ Compile a node that must be a condition (see `_compile`).
+
+        Args:
+            node (ast.AST): The node.
+            symbol (str): The operator applied to the node, for errors.
+
+        Returns:
+            Expression: The value of the node.
+
+        Raises:
+            ValueError: Raised if the node is not a condition.
+        """
+        value, kind = cls._compile(node)
+        if kind is not bool:
+            raise ValueError(
+                f'{symbol} applies to conditions, not to integers; '
+                f'{cls.PARENTHESES}'
+            )
+        return value
+
+    def evaluate(self, features):
+        """ Evaluate the expression on a batch of testcases.
+
+        Args:
+            features (numpy.ndarray): The feature bitmasks of the scenarios of
+                the testcases, of shape (testcases, rounds).
+
+        Returns:
+            numpy.ndarray: Whether each testcase is accepted.
+        """
+        result = self.function(features)
+        if result.ndim == 2:
+            result = result.all(axis=1)
+        return result.astype(bool)
+
+    def _apply(self, other, operator, symbol):
+        if isinstance(other, Expression):
+            function, text = other.function, other.text
+        else:
+            function, text = (lambda x: other), repr(other)
+        return Expression(
+            lambda x: operator(self.function(x), function(x)),
+            f'({self.text} {symbol} {text})'
+        )
+
+    def __and__(self, other):
+        return self._apply(other, lambda x, y: x & y, '&')
+
+    def __or__(self, other):
+        return self._apply(other, lambda x, y: x | y, '|')
+
+    def __invert__(self):
+        return Expression(lambda x: ~self.function(x), f'~{self.text}')
+
+    def __lt__(self, other):
+        return self._apply(other, lambda x, y: x < y, '<')
+
+    def __le__(self, other):
+        return self._apply(other, lambda x, y: x <= y, '<=')
+
+    def __eq__(self, other):
+        return self._apply(other, lambda x, y: x == y, '==')
+
+    def __ne__(self, other):
+        return self._apply(other, lambda x, y: x != y, '!=')
+
+    def __ge__(self, other):
+        return self._apply(other, lambda x, y: x >= y, '>=')
+
+    def __gt__(self, other):
+        return self._apply(other, lambda x, y: x > y, '>')
+
+    __hash__ = None
+
+    def __bool__(self):
+        raise TypeError(
+            'Filter expressions cannot be used as booleans; use &, | and ~ '
+            'instead of and, or and not.'
+        )
+
+    def __repr__(self):
+        return self.text
+
+
+class Rounds:
+    """ The reductions of the filter language over the rounds of testcases
+    (see `Expression`).
+    """
+
+    @staticmethod
+    def _term(expression):
+        if isinstance(expression, str):
+            return Expression.feature(expression)
+        if not isinstance(expression, Expression):
+            raise TypeError('Rounds are reduced over expressions.')
+        return expression
+
+    def any(self, expression):
+        """ Whether an expression holds in any round. """
+        expression = self._term(expression)
+        return Expression(
+            lambda x: expression.function(x).any(axis=1),
+            f'rounds.any({expression.text})'
+        )
+
+    def all(self, expression):
+        """ Whether an expression holds in every round. """
+        expression = self._term(expression)
+        return Expression(
+            lambda x: expression.function(x).all(axis=1),
+            f'rounds.all({expression.text})'
+        )
+
+    def count(self, expression):
+        """ The number of rounds in which an expression holds. """
+        expression = self._term(expression)
+        return Expression(
+            lambda x: expression.function(x).sum(axis=1),
+            f'rounds.count({expression.text})'
+        )
+
+    def at(self, index, expression):
+        """ The value of an expression in a given round (from 0). """
+        if type(index) is not int:
+            raise TypeError('The round of rounds.at must be an integer.')
+        expression = self._term(expression)
+        return Expression(
+            lambda x: expression.function(x)[:, index],
+            f'rounds.at({index}, {expression.text})'
+        )
+
+
+rounds = Rounds()
+
+
+class FilterCheck:
+    """ Run a `Filter` round after round while the generator walks the space
+    of testcases (see `Generator._walk`).
+    """
+
+    def __init__(self, generator, filter):
+        """ Instantiate the check.
+
+        Args:
+            generator (Generator): The generator instance.
+            filter (Filter): The filter.
+        """
+        self.generator = generator
+        self.filter = filter
+
+    def root(self):
+        """ The state of the check before the first round: the indices of
+        the scenarios of the rounds accepted so far.
+
+        Returns:
+            tuple: No scenarios.
+        """
+        return ()
+
+    def step(self, state, scenario):
+        """ Check the scenario of the next round.
+
+        Args:
+            state (tuple): The state after the previous rounds.
+            scenario (int): The index of the scenario of the next round.
+
+        Returns:
+            tuple: The new state, or None if the filter rejects the rounds.
+        """
+        rounds = state + (scenario,)
+        accepted = self.filter.accept_ids(self.generator, rounds)
+        return rounds if accepted else None
+
+
+class Symmetry:
+    """ A group of relabelings of the nodes that map every testcase onto an
+    equivalent one, ie. a testcase that the Twins Executor runs in the
+    same way.
+
+    The group acts on every round of a testcase in the same way. The
+    generator only prints one representative of each orbit, along with the
+    size of the orbit. The representative is the testcase with the smallest
+    scenario indices in lexicographic order among the canonical relabelings
+    of the honest nodes (see `_canonical`) of the testcases of the orbit.
+    The following groups are supported:
+
+    - 'twins': Each target node can be swapped with its twin.
+    - 'leaders': The target nodes can be relabeled in any way, each twin
+      being relabeled along with its target node.
+    - 'honest': The honest nodes without twin, which never lead, can be
+      relabeled in any way.
+    """
+    GROUPS = ('twins', 'leaders', 'honest')
+
+    def __init__(self, generator, groups):
+        """ Instantiate the group.
+
+        Args:
+            generator (Generator): The generator instance.
+            groups (tuple(str)): The groups generating the symmetry group.
+        """
+        self.generator = generator
+        self.groups = groups
+        self._tables = None
+        self._canonical_cache = {}
+
+    @property
+    def _identity(self):
+        nodes, leaders = self.generator.nodes, self.generator.target_nodes
+        return (tuple(range(len(nodes))), tuple(range(len(leaders))))
+
+    @property
+    def _factors(self):
+        """ The elements of each group generating the symmetry group, but
+        the relabelings of the honest nodes (see `_canonical`), the identity
+        first.
+
+        Returns:
+            list(list(tuple)): The elements of each group. An element is a
+                tuple (nodes, leaders): the node mapped to each node, and the
+                index of the target node mapped to each target node.
+        """
+        generator = self.generator
+        n, leaders = len(generator.nodes), len(generator.target_nodes)
+        identity = tuple(range(leaders))
+        factors = []
+        if 'twins' in self.groups:
+            swaps = []
+            for subset in product((False, True), repeat=leaders):
+                nodes = list(range(n))
+                for node in compress(generator.target_nodes, subset):
+                    twin = generator.get_twin(node)
+                    nodes[node], nodes[twin] = twin, node
+                swaps.append((tuple(nodes), identity))
+            factors.append(swaps)
+        if 'leaders' in self.groups:
+            relabelings = []
+            for targets in permutations(range(leaders)):
+                nodes = list(range(n))
+                for node, image in zip(generator.target_nodes, targets):
+                    nodes[node] = image
+                    nodes[generator.get_twin(node)] = generator.get_twin(
+                        generator.target_nodes[image]
+                    )
+                relabelings.append((tuple(nodes), targets))
+            factors.append(relabelings)
+        return factors
+
+    @staticmethod
+    def _combine(elements, others):
+        """ Compose every element with every other element.
+
+        Args:
+            elements (list(tuple)): A list of elements.
+            others (list(tuple)): Another list of elements.
+
+        Returns:
+            list(tuple): The compositions, the identity first if both lists
+                start with the identity.
+        """
+        return [
+            (
+                tuple(nodes[x] for x in other_nodes),
+                tuple(leaders[x] for x in other_leaders)
+            )
+            for other_nodes, other_leaders in others
+            for nodes, leaders in elements
+        ]
+
+    @property
+    def order(self):
+        """ The number of elements of the group.
+
+        Returns:
+            int: The order of the group.
+        """
+        order = sum(size for _, size in self._honest_classes)
+        for factor in self._factors:
+            order *= len(factor)
+        return order
+
+    @property
+    def _scenario_tables(self):
+        """ The scenario mapped to each scenario by each relabeling of the
+        target nodes and of their twins (see `_factors`) but the identity.
+        The tables of each group are built first, and then composed. The
+        tables are only built once.
+
+        Returns:
+            list(list(int)): A table of scenario indices per element.
+        """
+        if self._tables is None:
+            generator = self.generator
+            leaders = len(generator.target_nodes)
+            partitions = [
+                generator._partition_at(x) for x in range(generator.S(
+                    len(generator.nodes), generator.number_of_partitions
+                ))
+            ]
+            tables = [list(range(generator.scenarios_length))]
+            for factor in self._factors:
+                factor_tables = []
+                for nodes, targets in factor:
+                    images = [
+                        generator.index_of_partition(
+                            [[nodes[x] for x in part] for part in partition]
+                        )
+                        for partition in partitions
+                    ]
+                    factor_tables.append([
+                        images[x // leaders] * leaders + targets[x % leaders]
+                        for x in range(generator.scenarios_length)
+                    ])
+                tables = [
+                    [table[x] for x in other]
+                    for other in factor_tables for table in tables
+                ]
+            self._tables = tables[1:]
+        return self._tables
+
+    @property
+    def _honest_root(self):
+        """ The arrangements of the honest nodes before the first round (see
+        `_canonical`), or None if they cannot be relabeled.
+        """
+        if 'honest' not in self.groups:
+            return None
+        generator = self.generator
+        return ((tuple(range(generator.f, generator.number_of_nodes)),),)
+
+    def _canonical(self, arrangements, scenario):
+        """ Relabel the honest nodes of the scenario of the next round in a
+        canonical way, without listing the relabelings of the honest nodes.
+
+        The honest nodes get the labels f, f+1, ..., n-1 in the order that
+        makes the growth string of each round (the index of the part of each
+        node, in order of first appearance) the smallest, round after round.
+        The rounds before have already fixed the order of the honest nodes
+        up to some choices: an arrangement is a sequence of cells, each cell
+        holding the honest nodes of a range of labels, which the rounds
+        before do not tell apart. In the next round, the nodes of each cell
+        are sorted by the label of their part if the part already has one,
+        and the parts labeled in the cell by decreasing number of nodes;
+        parts that are still tied are tried in every order. The arrangements
+        that give the smallest growth string are kept for the next rounds.
+
+        Args:
+            arrangements (tuple): The arrangements giving the canonical
+                relabeling of the rounds before.
+            scenario (int): The index of the scenario of the next round.
+
+        Returns:
+            tuple: A tuple (scenario, arrangements), where `scenario` is the
+                index of the canonical scenario.
+        """
+        key = (arrangements, scenario)
+        cached = self._canonical_cache.get(key)
+        if cached is not None:
+            return cached
+
+        generator = self.generator
+        index, leader = divmod(scenario, len(generator.target_nodes))
+        partition = generator._partition_at(index)
+        parts = {x: i for i, part in enumerate(partition) for x in part}
+        targets = range(generator.f)
+        twins = range(generator.number_of_nodes, len(generator.nodes))
+
+        best, kept = None, []
+        for cells in arrangements:
+            labels = {}
+            for x in targets:
+                labels.setdefault(parts[x], len(labels))
+            states = [(labels, (), ())]
+            for cell in cells:
+                groups = {}
+                for x in cell:
+                    groups.setdefault(parts[x], []).append(x)
+                next_states = []
+                for labels, row, out in states:
+                    known = sorted(
+                        (x for x in groups if x in labels), key=labels.get
+                    )
+                    new = sorted(
+                        (x for x in groups if x not in labels),
+                        key=lambda x: -len(groups[x])
+                    )
+                    orders = [known]
+                    for _, tied in groupby(new, key=lambda x: len(groups[x])):
+                        tied = tuple(tied)
+                        orders = [
+                            x + list(y) for x in orders
+                            for y in permutations(tied)
+                        ]
+                    for order in orders:
+                        new_labels = dict(labels)
+                        for part in order:
+                            new_labels.setdefault(part, len(new_labels))
+                        next_states.append((
+                            new_labels,
+                            row + tuple(
+                                new_labels[x] for x in order for _ in groups[x]
+                            ),
+                            out + tuple(tuple(groups[x]) for x in order)
+                        ))
+                states = next_states
+            for labels, row, out in states:
+                for x in twins:
+                    labels.setdefault(parts[x], len(labels))
+                row = tuple(labels[parts[x]] for x in targets) + row + \
+                    tuple(labels[parts[x]] for x in twins)
+                if best is None or row < best:
+                    best, kept = row, [out]
+                elif row == best:
+                    kept.append(out)
+
+        k = generator.number_of_partitions
+        index = generator.index_of_partition(
+            generator._growth_string_to_partition(best, k)
+        )
+        result = (
+            index * len(generator.target_nodes) + leader,
+            tuple(sorted(set(kept)))
+        )
+        if len(self._canonical_cache) >= generator.SCENARIOS_CACHE_SIZE:
+            self._canonical_cache.clear()
+        self._canonical_cache[key] = result
+        return result
+
+    def root(self):
+        """ The state of the check before the first round: the elements of
+        the group that map the testcase onto itself so far, along with the
+        arrangements of the honest nodes (see `_canonical`).
+
+        Returns:
+            list(tuple): A list of (element, arrangements), where `element`
+                is the index of a table (see `_scenario_tables`), or None for
+                the identity.
+        """
+        honest = self._honest_root
+        return [(None, honest)] + [
+            (i, honest) for i in range(len(self._scenario_tables))
+        ]
+
+    def step(self, state, scenario):
+        """ Check whether a testcase can still be the representative of its
+        orbit after the scenario of the next round.
+
+        Args:
+            state (list(tuple)): The state after the previous rounds.
+            scenario (int): The index of the scenario of the next round.
+
+        Returns:
+            list(tuple): The new state, or None if the testcase is not the
+                representative of its orbit.
+        """
+        tables = self._scenario_tables
+        fixed = []
+        for element, arrangements in state:
+            image = scenario if element is None else tables[element][scenario]
+            if arrangements is not None:
+                image, arrangements = self._canonical(arrangements, image)
+            if image < scenario or element is None and image != scenario:
+                return None
+            if image == scenario:
+                fixed.append((element, arrangements))
+        return fixed
+
+    def _canonical_testcase(self, testcase):
+        """ Relabel the honest nodes of a testcase in a canonical way (see
+        `_canonical`).
+
+        Args:
+            testcase (tuple(int)): The index of the scenario of each round.
+
+        Returns:
+            tuple: A tuple (testcase, arrangements), where `arrangements` are
+                the arrangements of the honest nodes after the last round.
+        """
+        arrangements, scenarios = self._honest_root, []
+        for scenario in testcase:
+            scenario, arrangements = self._canonical(arrangements, scenario)
+            scenarios.append(scenario)
+        return tuple(scenarios), arrangements
+
+    def multiplicity(self, testcase):
+        """ Compute the size of the orbit of a testcase.
+
+        An element of the group maps the testcase onto itself if its
+        relabeling of the target nodes maps the testcase onto a testcase with
+        the same canonical relabeling of the honest nodes (see `_canonical`),
+        and its relabeling of the honest nodes then maps one onto the other.
+        For each such relabeling of the target nodes, there are as many
+        relabelings of the honest nodes as ways to arrange the honest nodes
+        into the canonical relabeling.
+
+        Args:
+            testcase (tuple(int)): The index of the scenario of each round.
+
+        Returns:
+            int: The number of testcases equivalent to the input testcase.
+        """
+        images = [testcase] + [
+            tuple(table[x] for x in testcase)
+            for table in self._scenario_tables
+        ]
+        if self._honest_root is None:
+            return self.order // images.count(testcase)
+
+        canonical, arrangements = self._canonical_testcase(testcase)
+        stabilizer = sum(
+            prod(f(len(x)) for x in cells) for cells in arrangements
+        )
+        stabilizer *= sum(
+            self._canonical_testcase(x)[0] == canonical for x in images
+        )
+        return self.order // stabilizer
+
+    def count(self):
+        """ Count the orbits of the testcases with Burnside's lemma: the
+        number of orbits is the average over the group of the number of
+        testcases mapped onto themselves. An element fixes a testcase if it
+        fixes the scenario of each round, and fixes a scenario if it fixes
+        both its leader and its partition. The number of partitions that an
+        element fixes only depends on the lengths of its cycles, so the
+        relabelings of the honest nodes are counted by cycle type rather than
+        one by one.
+
+        Returns:
+            int: The number of orbits.
+        """
+        generator = self.generator
+        k, rounds = generator.number_of_partitions, generator.number_of_rounds
+        elements = [self._identity]
+        for factor in self._factors:
+            elements = self._combine(elements, factor)
+
+        honest = set(range(generator.f, generator.number_of_nodes))
+        total = 0
+        for nodes, leaders in elements:
+            fixed_leaders = sum(x == y for x, y in enumerate(leaders))
+            cycles = self._cycles(
+                [y if x not in honest else None for x, y in enumerate(nodes)]
+            )
+            for honest_cycles, size in self._honest_classes:
+                fixed = self.fixed_partitions(cycles + honest_cycles, k)
+                total += size * (fixed_leaders * fixed) ** rounds
+        return total // self.order
+
+    @property
+    def _honest_classes(self):
+        """ The cycle types of the relabelings of the honest nodes, along
+        with the number of relabelings of each type.
+
+        Returns:
+            list(tuple): A list of (cycle lengths, number of relabelings).
+        """
+        m = self.generator.number_of_nodes - self.generator.f
+        if 'honest' not in self.groups:
+            return [([1] * m, 1)]
+
+        classes = []
+        for cycles in self._integer_partitions(m):
+            size = f(m)
+            for length in set(cycles):
+                count = cycles.count(length)
+                size //= length ** count * f(count)
+            classes.append((cycles, size))
+        return classes
+
+    @staticmethod
+    def _integer_partitions(m, largest=None):
+        """ Generate all ways of writing m as a sum of positive integers.
+
+        Args:
+            m (int): The integer.
+            largest (int, optional): The largest allowed term. Defaults to m.
+
+        Yields:
+            list(int): The terms, in decreasing order.
+        """
+        largest = m if largest is None else largest
+        if m == 0:
+            yield []
+            return
+        for term in range(min(m, largest), 0, -1):
+            for rest in Symmetry._integer_partitions(m - term, term):
+                yield [term] + rest
+
+    @staticmethod
+    def _cycles(permutation):
+        """ Compute the lengths of the cycles of a permutation.
+
+        Args:
+            permutation (tuple(int)): The image of each element. Elements
+                whose image is None are left out.
+
+        Returns:
+            list(int): The length of each cycle.
+        """
+        cycles, seen = [], [False] * len(permutation)
+        for x in range(len(permutation)):
+            length = 0
+            while not seen[x] and permutation[x] is not None:
+                seen[x], x, length = True, permutation[x], length + 1
+            if length:
+                cycles.append(length)
+        return cycles
+
+    @staticmethod
+    def fixed_partitions(cycles, k):
+        """ Count the partitions into k parts that a permutation maps onto
+        themselves, given the lengths of its cycles.
+
+        Such a permutation also permutes the parts of the partition, and the
+        parts that it cycles through form a cycle of d parts. All nodes of a
+        cycle of the permutation belong to the same cycle of parts, whose
+        length d divides the length of the cycle. The cycles of the
+        permutation are added one at a time: a cycle either starts a new
+        cycle of d parts (1 way), or joins one of the existing cycles of d
+        parts (d ways to align the nodes with the parts).
+
+        Args:
+            cycles (list(int)): The length of each cycle of the permutation.
+            k (int): The number of parts.
+
+        Returns:
+            int: The number of partitions mapped onto themselves.
+        """
+        # Map the number of cycles of parts of each length to a number of
+        # ways to arrange the cycles of the permutation seen so far.
+        ways = {(0,) * (k+1): 1}
+        for length in cycles:
+            new_ways = {}
+            for counts, number in ways.items():
+                parts = sum(d * c for d, c in enumerate(counts))
+                for d in range(1, min(length, k) + 1):
+                    if length % d:
+                        continue
+                    if parts + d <= k:
+                        new = list(counts)
+                        new[d] += 1
+                        new = tuple(new)
+                        new_ways[new] = new_ways.get(new, 0) + number
+                    if counts[d]:
+                        new_ways[counts] = (
+                            new_ways.get(counts, 0) + number * counts[d] * d
+                        )
+            ways = new_ways
+        return sum(
+            number for counts, number in ways.items()
+            if sum(d * c for d, c in enumerate(counts)) == k
+        )
+
+
+class Generator:
+    SCENARIOS_CACHE_SIZE = 1 << 16
+    WRITE_BUFFER_SIZE = 1 << 20
+    ORDERINGS = ('lexicographic', 'gray')
+    SAMPLINGS = ('uniform', 'stratified', 'reservoir')
+    FEATURES = (
+        'leader_isolated', 'leader_twin_split', 'twins_split', 'quorum',
+        'leader_quorum', 'leader_in_largest_block'
+    )
+    LEADER_BLOCK_SHIFT = 8
+    FORMATS = {
+        'json': JSONFormat, 'table': TableFormat, 'binary': BinaryFormat,
+        'npy': NpyFormat
+    }
+
+    def __init__(self, number_of_nodes, number_of_partitions, number_of_rounds,
+                 filter=None, folder_path='./', machine_index=1,
+                 number_of_machines=1, ordering='lexicographic',
+                 symmetry=None, cache_path=None, output_format='json'):
+        """ Instantiate the generator.
+
+        Args:
+            number_of_nodes (int): The number of nodes.
+            number_of_partitions (int): The number of partitions.
+            number_of_rounds (int): The number of rounds.
+            filter (Object, optional): A filter used to filter testcases before
+                printing them to file. If it is a `Filter`, it runs round
+                after round during the generation and prunes the testcases
+                starting with rejected rounds. Defaults to None.
+            folder_path (str, optional): The directory path where to print the
+                testcases. Defaults to './'.
+            machine_index (int, optional): The index of the machine on which
+                this generator instance is running. Defaults to 1.
+            number_of_machines (int, optional): The total number of machines
+                used to generate scenarios. Defaults to 1.
+            ordering (str, optional): The order in which testcases are
+                generated, either 'lexicographic' or 'gray' (see
+                `combine_scenarios_with_rounds`). Defaults to 'lexicographic'.
+            symmetry (str or list(str), optional): The groups of relabelings
+                of the nodes under which testcases are equivalent (see
+                `Symmetry`). Only one testcase of each class of equivalent
+                testcases is generated. Defaults to None.
+            cache_path (str, optional): The directory where to keep the
+                verdicts of named `RoundFilter`s across runs (see
+                `round_verdicts`). Defaults to None (no cache on disk).
+            output_format (str, optional): The format of the printed files,
+                either 'json' (see `JSONFormat`), 'table' (see `TableFormat`),
+                'binary' (see `BinaryFormat`) or 'npy' (see `NpyFormat`).
+                Defaults to 'json'.
+
+        Raises:
+            TypeError: Raised upon invalid input types.
+            ValueError: Raised upon invalid input values.
+        """
+        self.logger = logging.getLogger(name='generator')
+
+        ok = isinstance(number_of_nodes, int)
+        ok &= isinstance(number_of_partitions, int)
+        ok &= isinstance(number_of_rounds, int)
+        ok &= isinstance(folder_path, str)
+        ok &= isinstance(machine_index, int)
+        ok &= isinstance(number_of_machines, int)
+        ok &= isinstance(ordering, str)
+        ok &= cache_path is None or isinstance(cache_path, str)
+        ok &= isinstance(output_format, str)
+        if symmetry is None or isinstance(symmetry, str):
+            symmetry = () if symmetry is None else (symmetry,)
+        ok &= isinstance(symmetry, (list, tuple, set, frozenset))
+        ok = ok and all(isinstance(x, str) for x in symmetry)
+        if not ok:
+            message = 'Bad input types.'
+            self.logger.error(f'TypeError: {message}')
+            raise TypeError(message)
+
+        ok &= number_of_nodes > 0
+        ok &= number_of_partitions > 0
+        ok &= number_of_rounds > 0
+        ok &= machine_index > 0
+        ok &= number_of_machines >= machine_index
+        ok &= ordering in self.ORDERINGS
+        ok &= output_format in self.FORMATS
+        ok &= all(x in Symmetry.GROUPS for x in symmetry)
+        if not ok:
+            message = 'Bad input values.'
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
+
+        self.number_of_nodes = number_of_nodes
+        self.number_of_partitions = number_of_partitions
+        self.number_of_rounds = number_of_rounds
+        self.folder_path = folder_path
+        self.machine_index = machine_index
+        self.number_of_machines = number_of_machines
+        self.ordering = ordering
+        self.output_format = output_format
+        self.symmetry = tuple(x for x in Symmetry.GROUPS if x in symmetry)
+        self._symmetry = Symmetry(self, self.symmetry) if symmetry else None
+        self.filter = bool if filter is None else filter
+        if isinstance(filter, str):
+            self.filter = Expression.parse(filter)
+        self.pruned = 0
+        self.sampling = None
+        self.seed = 0
+        self.cache_path = cache_path
+        self._completions = None
+        self._features = None
+        self._verdicts = None
+        self._stirling = None
+        self._scenarios = {}
+        self._fragments = {}
+
+        self.f = (self.number_of_nodes - 1) // 3
+        self.nodes = [x for x in range(self.number_of_nodes+self.f)]
+
+        if isinstance(self.filter, Expression) and np is None:
+            message = 'Filter expressions require NumPy.'
+            self.logger.error(f'ImportError: {message}')
+            raise ImportError(message)
+
+        if isinstance(self.filter, Expression):
+            # Evaluate the expression once on a single testcase, so that it
+            # fails here rather than in every process.
+            try:
+                shape = (1, self.number_of_rounds)
+                self.filter.evaluate(np.zeros(shape, dtype=np.uint64))
+            except Exception as e:
+                message = (
+                    f'Filter expression {self.filter} does not apply to '
+                    f'{self.number_of_rounds} rounds ({e}).'
+                )
+                self.logger.error(f'ValueError: {message}')
+                raise ValueError(message)
+
+        if self.output_format == 'npy' and np is None:
+            message = 'The npy format requires NumPy.'
+            self.logger.error(f'ImportError: {message}')
+            raise ImportError(message)
+
+        if len(self.nodes) < self.number_of_partitions:
+            message = (
+                'There should be at least as many nodes as partitions. '
+                f'Input: {len(self.nodes)} nodes and '
+                f'{self.number_of_partitions} partitions.'
+            )
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
+
+        if self.output_format == 'npy' and self.space_length > 1 << 64:
+            message = (
+                'The positions of the testcases do not fit in the npy '
+                'format (64 bits).'
+            )
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
+
+        if self.testcases_length > 1000000000:
+            self.logger.warning(
+                'Running the generator with these configurations will '
+                'generate more than 1 billion testcases.'
+            )
+
+        self.logger.info(self.__repr__())
+
+    @property
+    def target_nodes(self):
+        """ The list of nodes that have a twin.
+
+        Returns:
+            list(int): A list of nodes' indeces.
+        """
+        return self.nodes[:self.f]
+
+    @property
+    def testcases_length(self):
+        """ Forecast the total number of testcases.
+
+        When a symmetry is set, this is the exact number of classes of
+        equivalent testcases, ie. the number of testcases generated.
+
+        Returns:
+            int: The total number of testcases.
+        """
+        if self._symmetry is None or self.space_length == 0:
+            return self.space_length
+        return self._symmetry.count()
+
+    @property
+    def space_length(self):
+        """ The number of positions of the testcases space, ie. the number
+        of testcases before any symmetry reduction.
+
+        Returns:
+            int: The size of the testcases space.
+        """
+        return self.scenarios_length ** self.number_of_rounds
+
+    @property
+    def scenarios_length(self):
+        """ The number of partition-leader scenarios that can be played in a
+        single round.
+
+        Returns:
+            int: The number of partition-leader scenarios.
+        """
+        total = self.S(len(self.nodes), self.number_of_partitions)
+        return total * len(self.target_nodes)
+
+    @property
+    def machine_range(self):
+        """ The contiguous range of testcases generated by this machine.
+
+        The testcases space is split into `number_of_machines` ranges of
+        (almost) equal size, so each machine only generates its own share.
+
+        Returns:
+            tuple(int): The positions [start, end) of the testcases.
+        """
+        return self._split(
+            0,
+            self.space_length,
+            self.number_of_machines,
+            self.machine_index - 1
+        )
+
+    @property
+    def filtered_length(self):
+        """ Count the testcases accepted by the filter, without generating
+        them. The filter needs to be a `RoundFilter`.
+
+        Returns:
+            int: The number of testcases that the generator prints.
+
+        Raises:
+            ValueError: Raised if the filter cannot be counted.
+        """
+        if self.filter is bool:
+            return self.testcases_length
+        self._check_countable()
+        return self._accepted_before(self.space_length)
+
+    def _check_countable(self):
+        if not isinstance(self.filter, RoundFilter) or self.symmetry:
+            message = (
+                'Only the testcases accepted by a RoundFilter can be counted, '
+                'and without symmetry.'
+            )
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
+
+    @property
+    def _balanced(self):
+        """ Whether testcases are split across machines and processes by
+        number of testcases accepted by the filter rather than by position.
+        """
+        return isinstance(self.filter, RoundFilter) and not self.symmetry
+
+    def _filter_completions(self):
+        """ Count the ways to complete testcases accepted by a `RoundFilter`.
+        These tables are only built once.
+
+        Returns:
+            tuple: A tuple (accepted, successors, completions), where
+                `accepted[x]` tells whether scenario x is accepted in a round,
+                `successors[x][y]` whether scenario y may follow scenario x,
+                and `completions[i][x]` is the number of ways to choose the
+                scenarios of the rounds after round i when round i has
+                scenario x.
+        """
+        if self._completions is None:
+            filter, base = self.filter, self.scenarios_length
+            accepted = self.round_verdicts
+            if filter.transition_predicate is None:
+                # Any accepted scenario may follow any scenario.
+                successors = [accepted] * base
+            else:
+                scenarios = [self._scenario(x) for x in range(base)]
+                successors = [
+                    bytearray(
+                        ok and filter.accept_transition(x, y)
+                        for y, ok in zip(scenarios, accepted)
+                    )
+                    for x in scenarios
+                ]
+            completions = [[1] * base]
+            for _ in range(self.number_of_rounds - 1):
+                following = completions[0]
+                if filter.transition_predicate is None:
+                    total = sum(compress(following, accepted))
+                    completions.insert(0, [total] * base)
+                else:
+                    completions.insert(0, [
+                        sum(compress(following, x)) for x in successors
+                    ])
+            self._completions = (accepted, successors, completions)
+        return self._completions
+
+    @property
+    def round_verdicts(self):
+        """ The verdict of the predicate of a `RoundFilter` on each scenario.
+
+        The predicate is evaluated once per scenario, and testcases only
+        combine the verdicts of their rounds. If the filter has a name and
+        the generator a `cache_path`, the verdicts are read from the cache
+        when they are there, and written to the cache otherwise, so that
+        later runs do not evaluate the predicate at all. The cache is keyed
+        by the name and version of the filter, and by the numbers of nodes
+        and partitions.
+
+        Returns:
+            bytearray: Whether each scenario is accepted, indexed by scenario
+                index.
+        """
+        if self._verdicts is None:
+            path = self._verdicts_path
+            if path is not None and isfile(path) \
+                    and getsize(path) == self.scenarios_length:
+                with open(path, 'rb') as f:
+                    self._verdicts = bytearray(f.read())
+                self.logger.debug(f'Read the filter verdicts from {path}.')
+            else:
+                self._verdicts = bytearray(
+                    self.filter.accept_round((leader, partition))
+                    for partition in self.iter_partitions()
+                    for leader in self.target_nodes
+                )
+                if path is not None:
+                    self._write_verdicts(path)
+        return self._verdicts
+
+    @property
+    def _verdicts_path(self):
+        if self.cache_path is None or self.filter.name is None:
+            return None
+        name = sub(r'[^\w.-]', '_', str(self.filter.name))
+        return join(
+            self.cache_path,
+            f'{name}-v{self.filter.version}-n{self.number_of_nodes}'
+            f'-k{self.number_of_partitions}.verdicts'
+        )
+
+    def _write_verdicts(self, path):
+        """ Write the verdicts to the cache. The file is written under a
+        temporary name and then renamed, so that concurrent runs never read
+        a partial file.
+
+        Args:
+            path (str): The path of the file.
+        """
+        makedirs(self.cache_path, exist_ok=True)
+        with NamedTemporaryFile(dir=self.cache_path, delete=False) as f:
+            f.write(self._verdicts)
+        replace(f.name, path)
+        self.logger.debug(f'Wrote the filter verdicts to {path}.')
+
+    def _accepted_before(self, index):
+        """ Count the testcases accepted by a `RoundFilter` whose positions
+        are smaller than `index`.
+
+        Args:
+            index (int): A position in [0, space_length].
+
+        Returns:
+            int: The number of accepted testcases.
+        """
+        accepted, successors, completions = self._filter_completions()
+        if index == self.space_length:
+            return sum(compress(completions[0], accepted))
+
+        testcase = self._scenarios_of(index)
+        total = 0
+        for i, scenario in enumerate(testcase):
+            allowed = accepted if i == 0 else successors[testcase[i-1]]
+            # Add the scenarios generated before this one in this round.
+            if self.ordering == 'gray' and sum(testcase[:i]) % 2:
+                before = slice(scenario + 1, None)
+            else:
+                before = slice(scenario)
+            total += sum(compress(completions[i][before], allowed[before]))
+            if not allowed[scenario]:
+                break
+        return total
+
+    def _position_of_accepted(self, count, start, end):
+        """ Find the smallest position in [start, end] before which at least
+        `count` testcases are accepted by a `RoundFilter`.
+
+        Args:
+            count (int): The number of accepted testcases.
+            start (int): The smallest position.
+            end (int): The largest position.
+
+        Returns:
+            int: The position.
+        """
+        while start < end:
+            middle = (start + end) // 2
+            if self._accepted_before(middle) < count:
+                start = middle + 1
+            else:
+                end = middle
+        return start
+
+    def __repr__(self):
+        twins_configs = (
+            f'(number of nodes: {self.number_of_nodes}, '
+            f'number of partitions: {self.number_of_partitions}, '
+            f'number of rounds: {self.number_of_rounds})'
+        )
+        return f'''Generator instantiated with the following settings:
+            \t Twins configs: {twins_configs}
+            \t testcases ordering: {self.ordering}
+            \t symmetry: {', '.join(self.symmetry) or None}
+            \t output directory: {self.folder_path}
+            \t machine #: {self.machine_index}/{self.number_of_machines}'''
+
+    def get_twin(self, node):
+        """ Get the twin of a specific node.
+
+        Args:
+            node (int): The index of the node for which to return the twin.
+
+        Returns:
+            int: A node's index.
+        """
+        assert node in self.target_nodes
+        return self.nodes[self.number_of_nodes+node]
+
+    def S(self, n, k):
+        """ Compute the Stirling numbers of the second kind.
+
+        Args:
+            n (int): Number of objects.
+            k (int): Number of non-empty subsets.
+
+        Returns:
+            int: The Stirling numbers of the second kind.
+        """
+        assert isinstance(n, int) and isinstance(k, int)
+        assert n > 0 and k > 0 and n >= k
+        S = [(-1)**i * (f(k)//f(i)//f(k - i)) * (k-i)**n for i in range(k+1)]
+        return sum(S) // f(k)
+
+    def make_partitions(self, order='legacy'):
+        """ Find all possible ways in which n nodes can be partitioned into k
+        partitions.
+
+        This problems is known as "Stirling Number of the Second Kind".
+        "In combinatorics, the Stirling numbers of the second kind tell
+        us how many ways there are of dividing up a set of n objects
+        (all different, or at least all labeled) into k nonempty subsets."
+
+        E.g. for n={0,1,2} and k=2, possible partition are:
+        [
+            [ [0,1], [2] ],
+            [ [0,2], [1] ],
+            [ [0], [1,2] ],
+        ]
+
+        Args:
+            order (str, optional): The order of the partitions, see
+                `iter_partitions`. Defaults to 'legacy'.
+
+        Returns:
+            list: All possible partitions.
+        """
+        return list(self.iter_partitions(order))
+
+    def iter_partitions(self, order='legacy'):
+        """ Generate all possible ways in which n nodes can be partitioned
+        into k partitions, one at a time.
+
+        In every partition, nodes are sorted within each part and parts are
+        sorted by their smallest node. Partitions are generated in one of the
+        following orders:
+
+        - 'legacy': The order in which `make_partitions` always listed
+          partitions. It follows the recurrence of the Stirling numbers of
+          the second kind: the partitions where the last node is alone come
+          first, followed by those where the last node joins the first part,
+          then the second part, and so on (recursively on the other nodes).
+        - 'rgs': The lexicographic order of the restricted growth strings
+          of the partitions, ie. the strings listing for each node the index
+          of its part. E.g. for n={0,1,2} and k=2: [0,0,1], [0,1,0], [0,1,1].
+
+        Both orders are generated iteratively, using memory linear in the
+        number of nodes.
+
+        Args:
+            order (str, optional): Either 'legacy' or 'rgs'.
+                Defaults to 'legacy'.
+
+        Yields:
+            list: A partition.
+
+        Raises:
+            ValueError: Raised upon invalid input values.
+        """
+        n, k = len(self.nodes), self.number_of_partitions
+        if order == 'legacy':
+            strings = self._legacy_growth_strings(n, k)
+        elif order == 'rgs':
+            strings = self._restricted_growth_strings(n, k)
+        else:
+            message = f'Unknown order of partitions: {order}.'
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
+        return (self._growth_string_to_partition(x, k) for x in strings)
+
+    @staticmethod
+    def _legacy_growth_strings(n, k):
+        """ Generate the growth strings of the partitions of n objects into
+        k sets, in 'legacy' order.
+
+        The nodes are considered from the last to the first. At each step,
+        with m nodes left to place into j sets, node m-1 either is alone
+        (choice 0) or joins the set c-1 (choice c). The choices are explored
+        depth-first from an explicit stack until j=1 (all remaining nodes
+        are together) or j=m (all remaining nodes are alone).
+
+        Args:
+            n (int): The number of objects.
+            k (int): The number of sets.
+
+        Yields:
+            list(int): The index of the set of each object.
+        """
+        choices, m, j = [], n, k
+        while True:
+            while j != 1 and j != m:
+                choices.append((m, j, 0))
+                m, j = m-1, j-1
+
+            string = [0] * m if j == 1 else list(range(m))
+            for _, sets, choice in reversed(choices):
+                string.append(sets-1 if choice == 0 else choice-1)
+            yield string
+
+            while choices:
+                m, j, c = choices.pop()
+                if c < j:
+                    choices.append((m, j, c+1))
+                    m -= 1
+                    break
+            else:
+                return
+
+    @staticmethod
+    def _restricted_growth_strings(n, k):
+        """ Generate the restricted growth strings of the partitions of n
+        objects into k sets, in lexicographic order.
+
+        Args:
+            n (int): The number of objects.
+            k (int): The number of sets.
+
+        Yields:
+            list(int): The index of the set of each object.
+        """
+        string = [0] * (n-k) + list(range(k))
+        while True:
+            yield list(string)
+
+            # Find the last object that can be moved to the next set.
+            maximums = [-1] * n
+            for i in range(1, n):
+                maximums[i] = max(maximums[i-1], string[i-1])
+            for i in reversed(range(1, n)):
+                value = string[i] + 1
+                top = max(maximums[i], value)
+                missing = k - top - 1
+                if value > maximums[i] + 1 or value >= k:
+                    continue
+                if missing > n - i - 1:
+                    continue
+                string[i] = value
+                string[i+1:] = [0] * (n-i-1-missing) + list(range(top+1, k))
+                break
+            else:
+                return
+
+    @staticmethod
+    def _growth_string_to_partition(string, k):
+        """ Convert a growth string into a partition.
+
+        Args:
+            string (list(int)): The index of the set of each object.
+            k (int): The number of sets.
+
+        Returns:
+            list: A partition.
+        """
+        partition = [[] for _ in range(k)]
+        for node, i in enumerate(string):
+            partition[i].append(node)
+        return partition
+
+    def partition_at(self, index):
+        """ Get the partition at a specific position of `make_partitions`.
+
+        The partition is built directly from the recurrence of the Stirling
+        numbers of the second kind, S(m,j) = S(m-1,j-1) + j*S(m-1,j), in
+        O(n) steps: the first S(m-1,j-1) positions are the partitions where
+        node m-1 is alone, then come S(m-1,j) positions for each part that
+        node m-1 can join.
+
+        Args:
+            index (int): The position of the partition, in [0, S(n,k)).
+
+        Returns:
+            list: A partition.
+
+        Raises:
+            TypeError: Raised upon invalid input types.
+            ValueError: Raised upon invalid input values.
+        """
+        if not isinstance(index, int):
+            message = 'Bad input types.'
+            self.logger.error(f'TypeError: {message}')
+            raise TypeError(message)
+
+        S = self._stirling_table
+        n, k = len(self.nodes), self.number_of_partitions
+        if not 0 <= index < S[n][k]:
+            message = f'Partition index {index} is out of range.'
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
+
+        return self._partition_at(index)
+
+    def _partition_at(self, index):
+        S = self._stirling_table
+        m, j = len(self.nodes), self.number_of_partitions
+        string = [0] * m
+        while j != 1 and j != m:
+            if index < S[m-1][j-1]:
+                string[m-1] = j-1
+                j -= 1
+            else:
+                index -= S[m-1][j-1]
+                string[m-1], index = divmod(index, S[m-1][j])
+            m -= 1
+        string[:m] = [0] * m if j == 1 else range(m)
+        k = self.number_of_partitions
+        return self._growth_string_to_partition(string, k)
+
+    def index_of_partition(self, partition):
+        """ Get the position of a partition in `make_partitions`.
+
+        This is the inverse of `partition_at`. Parts and nodes within parts
+        may be given in any order.
+
+        Args:
+            partition (list): A partition of all nodes into k parts.
+
+        Returns:
+            int: The position of the partition, in [0, S(n,k)).
+
+        Raises:
+            ValueError: Raised upon invalid input values.
+        """
+        try:
+            parts = sorted(sorted(part) for part in partition)
+            assert len(parts) == self.number_of_partitions
+            assert all(parts)
+            string = [None] * len(self.nodes)
+            for i, part in enumerate(parts):
+                for node in part:
+                    assert string[node] is None
+                    string[node] = i
+            assert None not in string
+        except (AssertionError, IndexError, TypeError):
+            message = f'Not a valid partition: {partition}.'
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
+
+        S = self._stirling_table
+        index, m, j = 0, len(self.nodes), self.number_of_partitions
+        while j != 1 and j != m:
+            if parts[string[m-1]][0] == m-1:
+                j -= 1
+            else:
+                index += S[m-1][j-1] + string[m-1] * S[m-1][j]
+            m -= 1
+        return index
+
+    @property
+    def _stirling_table(self):
+        """ The Stirling numbers of the second kind S(m,j), for all m up to
+        the number of nodes and all j up to the number of partitions. The
+        table is only built once.
+
+        Returns:
+            list(list(int)): The table of Stirling numbers, indexed by [m][j].
+        """
+        if self._stirling is None:
+            n, k = len(self.nodes), self.number_of_partitions
+            S = [[1] + [0] * k] + [[0] * (k+1) for _ in range(n)]
+            for m in range(1, n+1):
+                for j in range(1, k+1):
+                    S[m][j] = j * S[m-1][j] + S[m-1][j-1]
+            self._stirling = S
+        return self._stirling
+
+    def combine_partitions_with_leaders(self, partitions):
+        """ Find all possible ways in which we can assign leaders to partitions.
+
+        E.g. for l={0,1} leaders, n={0,1,2} nodes and k=2 partitions, possible
+        combinations are:
+        [
+            (0, [ [0,1], [2] ]),
+            (0, [ [0,2], [1] ]),
+            (1, [ [1,2], [0] ]),
+            (0, [ [2], [0,1] ]),
+            ...
+        ]
+
+        Args:
+            partitions (list): List of all partitions.
+
+        Yields:
+            iterable: An iterator of tuples of (leader, partition)
+        """
+        for partition in partitions:
+            for leader in self.target_nodes:
+                yield (leader, partition)
+
+    def scenario_at(self, index):
+        """ Get the partition-leader scenario at a specific position of
+        `combine_partitions_with_leaders`.
+
+        Args:
+            index (int): The position of the scenario, in
+                [0, scenarios_length).
+
+        Returns:
+            tuple: A tuple of (leader, partition).
+
+        Raises:
+            TypeError: Raised upon invalid input types.
+            ValueError: Raised upon invalid input values.
+        """
+        if not isinstance(index, int):
+            message = 'Bad input types.'
+            self.logger.error(f'TypeError: {message}')
+            raise TypeError(message)
+
+        if not 0 <= index < self.scenarios_length:
+            message = f'Scenario index {index} is out of range.'
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
+
+        return self._scenario(index)
+
+    def _scenario(self, index):
+        """ Same as `scenario_at`, but without input checks and with a
+        bounded cache of the scenarios recently built.
+        """
+        scenario = self._scenarios.get(index)
+        if scenario is None:
+            if len(self._scenarios) >= self.SCENARIOS_CACHE_SIZE:
+                self._scenarios.clear()
+            partition, leader = divmod(index, len(self.target_nodes))
+            partition = self._partition_at(partition)
+            scenario = (self.target_nodes[leader], partition)
+            self._scenarios[index] = scenario
+        return scenario
+
+    def _fragment(self, index):
+        """ The json fragments of the leaders and of the partition of a
+        scenario, with a bounded cache of the scenarios recently rendered.
+
+        Args:
+            index (int): The index of the scenario.
+
+        Returns:
+            tuple(str): The json of the leaders and of the partition.
+        """
+        fragment = self._fragments.get(index)
+        if fragment is None:
+            if len(self._fragments) >= self.SCENARIOS_CACHE_SIZE:
+                self._fragments.clear()
+            leader, partition = self._scenario(index)
+            leaders = [leader]
+            if leader < self.f:
+                leaders.append(self.get_twin(leader))
+            fragment = (dumps(leaders), dumps(partition))
+            self._fragments[index] = fragment
+        return fragment
+
+    @property
+    def scenario_features(self):
+        """ The features of each scenario, as a bitmask. The table is only
+        computed once.
+
+        Bit i is set if the scenario has the feature `FEATURES[i]`:
+        - 'leader_isolated': The block of the leader only holds the leader
+          and its twin.
+        - 'leader_twin_split': The leader and its twin are in different
+          blocks.
+        - 'twins_split': A node and its twin are in different blocks.
+        - 'quorum': A block holds 2f+1 distinct nodes (a node and its twin
+          only count once).
+        - 'leader_quorum': The block of the leader holds 2f+1 distinct nodes.
+        - 'leader_in_largest_block': The leader is in a largest block.
+        The bits from `LEADER_BLOCK_SHIFT` hold the number of nodes in the
+        block of the leader.
+
+        Returns:
+            array: The bitmask of each scenario, indexed by scenario index.
+        """
+        if self._features is None:
+            self._features = array('L')
+            for partition in self.iter_partitions():
+                self._features.extend(self._partition_features(partition))
+        return self._features
+
+    def _partition_features(self, partition):
+        """ Compute the bitmasks of the scenarios of a partition (see
+        `scenario_features`).
+
+        Args:
+            partition (list(list(int))): A partition.
+
+        Returns:
+            list(int): The bitmask of the scenario of each leader.
+        """
+        n, quorum = self.number_of_nodes, 2 * self.f + 1
+        bits = {x: self.feature_mask(x) for x in self.FEATURES}
+        block_of = {x: i for i, part in enumerate(partition) for x in part}
+        sizes = [len(x) for x in partition]
+        distinct = [len({x % n for x in part}) for part in partition]
+
+        shared = 0
+        if any(block_of[x] != block_of[self.get_twin(x)]
+               for x in self.target_nodes):
+            shared |= bits['twins_split']
+        if max(distinct) >= quorum:
+            shared |= bits['quorum']
+
+        masks = []
+        for leader in self.target_nodes:
+            block = block_of[leader]
+            mask = shared | sizes[block] << self.LEADER_BLOCK_SHIFT
+            if distinct[block] == 1:
+                mask |= bits['leader_isolated']
+            if block_of[self.get_twin(leader)] != block:
+                mask |= bits['leader_twin_split']
+            if distinct[block] >= quorum:
+                mask |= bits['leader_quorum']
+            if sizes[block] == max(sizes):
+                mask |= bits['leader_in_largest_block']
+            masks.append(mask)
+        return masks
+
+    @classmethod
+    def feature_mask(cls, *features):
+        """ Get the bitmask of a set of features (see `scenario_features`).
+
+        Args:
+            *features (str): The names of the features.
+
+        Returns:
+            int: The bitmask.
+
+        Raises:
+            ValueError: Raised upon unknown features.
+        """
+        mask = 0
+        for feature in features:
+            if feature not in cls.FEATURES:
+                raise ValueError(f'Unknown feature: {feature}.')
+            mask |= 1 << cls.FEATURES.index(feature)
+        return mask
+
+    def combine_scenarios_with_rounds(self, scenarios):
+        """ Combine the input parition-leader scenarios with rounds.
+
+        E.g. for l={0,1} leaders, n={0,1,2} nodes, k=2 partitions, and r=2
+        rounds, possible combinations are:
+        [
+            [(0, [ [0,1], [2] ]), (0, [ [0,1], [2] ])],
+            [(0, [ [0,1], [2] ]), (0, [ [0,2], [1] ])],
+            [(1, [ [1,2], [0] ]), (1, [ [1,2], [0] ])],
+            [(0, [ [2], [0,1] ]), (1, [ [1,2], [0] ])],
+            ...
+        ]
+
+        With the 'gray' ordering, testcases are instead listed in the order
+        of the reflected mixed-radix Gray code: two consecutive testcases
+        only differ by the scenario of a single round. Reading the scenarios
+        of the rounds as the digits of a number, a round plays its
+        scenarios in increasing order if the previous rounds play scenarios
+        whose indices sum to an even number, and in decreasing order
+        otherwise.
+
+        Args:
+            iterable: An iterator of tuples of (leader, partition).
+
+        Returns:
+            iterable: An iterator of testcases.
+        """
+        if self.ordering == 'lexicographic':
+            return product(scenarios, repeat=self.number_of_rounds)
+
+        scenarios = list(scenarios)
+        base, length = len(scenarios), len(scenarios) ** self.number_of_rounds
+        return (
+            tuple(scenarios[x] for x in testcase)
+            for testcase in self._walk(base, 0, length)
+        )
+
+    def testcase_at(self, index):
+        """ Get the testcase at a specific position of the testcases space.
+
+        The position is the one at which `combine_scenarios_with_rounds`
+        yields the testcase, so the testcase is found without walking the
+        space from the start. The index is read as a number written in base
+        `scenarios_length`, whose most significant digit is the scenario of
+        the first round.
+
+        Args:
+            index (int): The position of the testcase, in
+                [0, space_length).
+
+        Returns:
+            tuple: A tuple of (leader, partition), one per round.
+
+        Raises:
+            TypeError: Raised upon invalid input types.
+            ValueError: Raised upon invalid input values.
+        """
+        if not isinstance(index, int):
+            message = 'Bad input types.'
+            self.logger.error(f'TypeError: {message}')
+            raise TypeError(message)
+
+        if not 0 <= index < self.space_length:
+            message = f'Testcase index {index} is out of range.'
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
+
+        return self._decode(self._scenarios_of(index))
+
+    def iter_testcases(self, start, end):
+        """ Generate the testcases whose positions are in [start, end).
+
+        Testcases are generated in the order of
+        `combine_scenarios_with_rounds`, but the generation directly starts
+        at position `start` instead of walking the space from the start.
+        Testcases are encoded as tuples of scenario indices (see `encode`).
+        When a symmetry is set, only the representative of each class of
+        equivalent testcases is generated; the other testcases are skipped
+        without being generated.
+
+        Args:
+            start (int): The position of the first testcase.
+            end (int): The position after the last testcase.
+
+        Yields:
+            tuple(int): The index of the scenario of each round.
+
+        Raises:
+            TypeError: Raised upon invalid input types.
+            ValueError: Raised upon invalid input values.
+        """
+        self._check_range(start, end)
+        return self._iter_testcases(start, end)
+
+    def sample(self, count, seed=0):
+        """ Draw testcases uniformly at random from the whole space of
+        testcases, without replacement.
+
+        The sample only depends on `count` and `seed`, so every machine and
+        process can draw it on its own and select its share. The testcases
+        are drawn by position and then unranked (see `testcase_at`), so the
+        space is never walked. The symmetry is ignored (any testcase can be
+        drawn); the filter only applies when printing the testcases.
+
+        Args:
+            count (int): The number of testcases to draw.
+            seed (int, optional): The seed of the random number generator.
+                Defaults to 0.
+
+        Yields:
+            tuple(int): The index of the scenario of each round, in the order
+                of the positions of the testcases.
+
+        Raises:
+            TypeError: Raised upon invalid input types.
+            ValueError: Raised upon invalid input values.
+        """
+        positions = self._sample_positions(count, seed)
+        return (self._scenarios_of(x) for x in positions)
+
+    def _sample_positions(self, count, seed):
+        """ Draw positions of testcases for `sample`.
+
+        Args:
+            count (int): The number of positions to draw.
+            seed (int): The seed of the random number generator.
+
+        Returns:
+            list(int): The positions, in increasing order.
+
+        Raises:
+            TypeError: Raised upon invalid input types.
+            ValueError: Raised upon invalid input values.
+        """
+        self._check_count(count, seed)
+        random = Random(seed)
+        if 2 * count > self.space_length:
+            return sorted(random.sample(range(self.space_length), count))
+        # The space may be too large for `Random.sample`, but most draws are
+        # new positions.
+        positions = set()
+        while len(positions) < count:
+            positions.add(random.randrange(self.space_length))
+        return sorted(positions)
+
+    def _check_count(self, count, seed):
+        """ Check that `count` testcases can be drawn with `seed`.
+
+        Args:
+            count (int): The number of testcases to draw.
+            seed (int): The seed of the random number generator.
+
+        Raises:
+            TypeError: Raised upon invalid input types.
+            ValueError: Raised upon invalid input values.
+        """
+        if not isinstance(count, int) or not isinstance(seed, int):
+            message = 'Bad input types.'
+            self.logger.error(f'TypeError: {message}')
+            raise TypeError(message)
+
+        if not 0 <= count <= self.space_length:
+            message = (
+                f'Cannot draw {count} testcases out of {self.space_length}.'
+            )
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
+
+    @property
+    def strata(self):
+        """ The strata of scenarios used by `stratified_sample`. The stratum
+        of a scenario is the sizes of the blocks of its partition, along with
+        whether its leader is in a largest block.
+
+        Returns:
+            list(tuple): A list of (block sizes in decreasing order, whether
+                the leader is in a largest block).
+        """
+        strata = []
+        for sizes in Symmetry._integer_partitions(len(self.nodes)):
+            if len(sizes) == self.number_of_partitions:
+                strata.append((tuple(sizes), True))
+                if sizes[-1] < sizes[0]:
+                    strata.append((tuple(sizes), False))
+        return strata
+
+    def stratum_of(self, scenario):
+        """ Get the stratum of a scenario (see `strata`).
+
+        Args:
+            scenario (tuple): A (leader, partition) scenario.
+
+        Returns:
+            tuple: The stratum of the scenario.
+        """
+        leader, partition = scenario
+        sizes = sorted((len(x) for x in partition), reverse=True)
+        largest = any(len(x) == sizes[0] and leader in x for x in partition)
+        return (tuple(sizes), largest)
+
+    def _stratum_length(self, stratum):
+        """ Count the scenarios of a stratum (see `strata`).
+
+        Every node is in a largest block of the same number of partitions,
+        namely the fraction (blocks of the largest size) * (largest size) /
+        (nodes) of the partitions with these block sizes.
+
+        Args:
+            stratum (tuple): The stratum.
+
+        Returns:
+            int: The number of scenarios of the stratum.
+        """
+        sizes, largest = stratum
+        partitions = f(len(self.nodes))
+        for size, blocks in groupby(sizes):
+            partitions //= f(size) ** len(tuple(blocks))
+        for _, blocks in groupby(sizes):
+            partitions //= f(len(tuple(blocks)))
+        in_largest = partitions * sizes.count(sizes[0]) * sizes[0] \
+            // len(self.nodes)
+        if not largest:
+            in_largest = partitions - in_largest
+        return in_largest * len(self.target_nodes)
+
+    def stratified_sample(self, count, seed=0):
+        """ Draw testcases at random, so that the scenarios of each round are
+        spread evenly across strata (see `strata`).
+
+        Uniform sampling (see `sample`) mostly draws the scenarios of the
+        most common strata. Instead, the scenarios of each round are assigned
+        to the strata in equal quotas, capped at the number of testcases a
+        stratum can supply, and each scenario is then drawn uniformly in its
+        stratum. Testcases are drawn without replacement and
+        without walking the space. The sample only depends on `count` and
+        `seed`.
+
+        Args:
+            count (int): The number of testcases to draw.
+            seed (int, optional): The seed of the random number generator.
+                Defaults to 0.
+
+        Yields:
+            tuple(int): The index of the scenario of each round, in the order
+                of the positions of the testcases.
+
+        Raises:
+            TypeError: Raised upon invalid input types.
+            ValueError: Raised upon invalid input values.
+        """
+        positions = self._stratified_positions(count, seed)
+        return (self._scenarios_of(x) for x in positions)
+
+    def _stratified_positions(self, count, seed, attempts=100):
+        """ Draw positions of testcases for `stratified_sample`.
+
+        Args:
+            count (int): The number of positions to draw.
+            seed (int): The seed of the random number generator.
+            attempts (int, optional): The number of times a testcase is drawn
+                again when it was already drawn, or its strata are swapped
+                when they are used up. Defaults to 100.
+
+        Returns:
+            list(int): The positions, in increasing order.
+
+        Raises:
+            TypeError: Raised upon invalid input types.
+            ValueError: Raised upon invalid input values.
+        """
+        self._check_count(count, seed)
+        random, strata = Random(seed), self.strata
+        # A stratum appears in a round of at most this many testcases. The
+        # strata that cannot fill their share leave the rest to the others.
+        others = self.scenarios_length ** (self.number_of_rounds - 1)
+        capacity = {x: self._stratum_length(x) * others for x in strata}
+        quotas = []
+        for _ in range(self.number_of_rounds):
+            shuffled = random.sample(strata, len(strata))
+            shuffled.sort(key=capacity.get)
+            quota, left = [], count
+            for i, stratum in enumerate(shuffled):
+                share = min(capacity[stratum], -(-left // (len(strata) - i)))
+                quota += [stratum] * share
+                left -= share
+            random.shuffle(quota)
+            quotas.append(quota)
+
+        # The testcases of a combination of strata are also limited. A used
+        # up combination swaps the stratum of a round with a later testcase,
+        # which keeps the quotas of that round. If no swap helps, the
+        # testcase is drawn among all the testcases instead.
+        testcases = [list(x) for x in zip(*quotas)]
+        positions, used, members = set(), {}, None
+        for i, testcase_strata in enumerate(testcases):
+            for _ in range(attempts):
+                key = tuple(testcase_strata)
+                if used.get(key, 0) < prod(map(self._stratum_length, key)):
+                    break
+                if i + 1 < count:
+                    other = testcases[random.randrange(i + 1, count)]
+                    j = random.randrange(self.number_of_rounds)
+                    testcase_strata[j], other[j] = other[j], testcase_strata[j]
+            else:
+                key = None
+
+            for _ in range(attempts):
+                if key is None:
+                    position = random.randrange(self.space_length)
+                else:
+                    position = self._position(tuple(
+                        self._draw_scenario(random, x) for x in key
+                    ))
+                if position not in positions:
+                    break
+            else:
+                # Nearly every candidate testcase is drawn already.
+                if key is None:
+                    candidates = range(self.space_length)
+                else:
+                    if members is None:
+                        members = {x: [] for x in strata}
+                        for index in range(self.scenarios_length):
+                            scenario = self.scenario_at(index)
+                            members[self.stratum_of(scenario)].append(index)
+                    testcases_of = product(*(members[x] for x in key))
+                    candidates = map(self._position, testcases_of)
+                position = next(x for x in candidates if x not in positions)
+            positions.add(position)
+            key = tuple(
+                self.stratum_of(self.scenario_at(x))
+                for x in self._scenarios_of(position)
+            )
+            used[key] = used.get(key, 0) + 1
+        return sorted(positions)
+
+    def _draw_scenario(self, random, stratum):
+        """ Draw a scenario uniformly at random in a stratum.
+
+        Cutting a random permutation of the nodes into blocks of the sizes of
+        the stratum gives every partition with these block sizes with the
+        same probability. Partitions are drawn again until the leader is (or
+        is not) in a largest block.
+
+        Args:
+            random (Random): The random number generator.
+            stratum (tuple): The stratum.
+
+        Returns:
+            int: The index of the scenario.
+        """
+        sizes, largest = stratum
+        leader = random.randrange(len(self.target_nodes))
+        while True:
+            nodes = random.sample(self.nodes, len(self.nodes))
+            partition = []
+            for size in sizes:
+                partition.append(nodes[:size])
+                nodes = nodes[size:]
+            scenario = (self.target_nodes[leader], partition)
+            if self.stratum_of(scenario)[1] == largest:
+                break
+        partition = self.index_of_partition(partition)
+        return partition * len(self.target_nodes) + leader
+
+    def estimate_selectivity(self, n_samples=1000, seed=0,
+                             testcases_per_file=1000, confidence=1.96,
+                             workers=1):
+        """ Estimate how many testcases the generator prints, and how much
+        output it writes, from a uniform sample of the space of testcases
+        (see `sample`).
+
+        A sampled testcase counts as printed if it is the representative of
+        its class under the symmetry (if any) and if the filter accepts it.
+        The interval is the Wilson score interval of the fraction of printed
+        testcases. The size of the output is projected from the printed
+        testcases of the sample, in the output format (see
+        `JSONFormat.sizes`), for a run on all the machines where each
+        process prints its own files (see `run`).
+
+        Args:
+            n_samples (int, optional): The number of testcases to draw.
+                Defaults to 1000.
+            seed (int, optional): The seed of the random number generator.
+                Defaults to 0.
+            testcases_per_file (int, optional): The maximum number of testcases
+                that can be printing int a single file. Defaults to 1000.
+            confidence (float, optional): The number of standard deviations of
+                the interval. Defaults to 1.96 (95% confidence).
+            workers (int, optional): The number of processes of each machine.
+                Defaults to 1.
+
+        Returns:
+            dict: The estimates: 'samples' (the number of drawn testcases),
+                'accepted' (the number of printed testcases of the sample),
+                'selectivity' and 'selectivity_interval' (the fraction of
+                printed testcases), 'testcases' and 'testcases_interval' (the
+                number of printed testcases), 'files' (the number of files of
+                all the machines) and 'bytes' (the total size of the files).
+                All the estimates
+                are 0 if the space of testcases is empty.
+
+        Raises:
+            TypeError: Raised upon invalid input types.
+            ValueError: Raised upon invalid input values.
+        """
+        ok = isinstance(n_samples, int)
+        ok &= isinstance(testcases_per_file, int)
+        ok &= isinstance(confidence, (int, float))
+        ok &= isinstance(workers, int)
+        if not ok:
+            message = 'Bad input types.'
+            self.logger.error(f'TypeError: {message}')
+            raise TypeError(message)
+        if n_samples <= 0 or testcases_per_file <= 0 or confidence <= 0 \
+                or workers <= 0:
+            message = 'Bad input values.'
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
+
+        if self.space_length == 0:
+            return {
+                'samples': 0, 'accepted': 0, 'selectivity': 0.,
+                'selectivity_interval': (0., 0.), 'testcases': 0,
+                'testcases_interval': (0, 0), 'files': 0, 'bytes': 0
+            }
+
+        n_samples = min(n_samples, self.space_length)
+        testcases = list(self.sample(n_samples, seed))
+        accepted = [x for x in testcases if self._is_representative(x)]
+        if isinstance(self.filter, Expression):
+            matrix = np.array(accepted, dtype=self.scenario_dtype)
+            matrix = matrix.reshape(-1, self.number_of_rounds)
+            accepted = list(compress(accepted, self._evaluate(matrix)))
+        else:
+            accepted = [x for x in accepted if self._accepts(x)]
+
+        # Wilson score interval.
+        n, z = n_samples, confidence
+        p = len(accepted) / n
+        center = (p + z * z / (2 * n)) / (1 + z * z / n)
+        half = z * sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+        half /= 1 + z * z / n
+        interval = (max(0., center - half), min(1., center + half))
+
+        # Each process of each machine cuts its own share of the printed
+        # testcases into files (see `_print`). With a `RoundFilter`, the
+        # shares hold the same number of printed testcases (see `_split`).
+        testcases = round(p * self.space_length)
+        total = testcases if self._balanced else self.space_length
+        machines, chunks = self.number_of_machines, 0
+        for machine in range(machines):
+            machine_range = self._split_evenly(0, total, machines, machine)
+            for worker in range(workers):
+                start, end = self._split_evenly(
+                    *machine_range, workers, worker
+                )
+                share = end - start
+                if not self._balanced:
+                    share = round(p * share)
+                chunks += -(-share // testcases_per_file)
+        formatter = self.FORMATS[self.output_format]
+        header, size = formatter.sizes(self, accepted)
+        files = chunks * formatter.FILES
+        size = chunks * header + testcases * size
+        if self.output_format == 'table':
+            # Every machine prints the table.
+            files += machines
+            size += machines * len(TableFormat.make_table(self))
+        estimates = {
+            'samples': n,
+            'accepted': len(accepted),
+            'selectivity': p,
+            'selectivity_interval': interval,
+            'testcases': testcases,
+            'testcases_interval': tuple(
+                round(x * self.space_length) for x in interval
+            ),
+            'files': files,
+            'bytes': round(size),
+        }
+        self.logger.info(
+            f'The filter accepts {len(accepted)} of {n} sampled testcases: '
+            f'about {testcases} testcases (between '
+            f'{estimates["testcases_interval"][0]} and '
+            f'{estimates["testcases_interval"][1]}) in {files} files, '
+            f'for about {estimates["bytes"]} bytes.'
+        )
+        return estimates
+
+    def _is_representative(self, testcase):
+        """ Check whether a testcase is the representative of its class under
+        the symmetry (see `Symmetry`).
+
+        Args:
+            testcase (tuple(int)): The index of the scenario of each round.
+
+        Returns:
+            bool: Whether the generator generates the testcase.
+        """
+        if self._symmetry is None:
+            return True
+        state = self._symmetry.root()
+        for scenario in testcase:
+            state = self._symmetry.step(state, scenario)
+            if state is None:
+                return False
+        return True
+
+    def reservoir_sample(self, count, seed=0, workers=1):
+        """ Draw testcases uniformly at random among the testcases of this
+        machine (see `machine_range`) accepted by the filter, whatever the
+        filter is.
+
+        Each process walks its share of the testcases and keeps the `count`
+        accepted testcases with the smallest keys, where the key of a
+        testcase is a hash of its position and of the seed (see
+        `sample_key`). The keys are independent and uniformly distributed,
+        so the `count` testcases with the smallest keys among those of all
+        processes (or all machines) are a uniform sample of the accepted
+        testcases. Memory stays in O(count) per process.
+
+        Args:
+            count (int): The number of testcases to draw.
+            seed (int, optional): The seed of the keys. Defaults to 0.
+            workers (int, optional): The number of processes to use.
+                Defaults to 1.
+
+        Returns:
+            list(tuple(int)): The index of the scenario of each round of the
+                drawn testcases, in the order of their positions.
+
+        Raises:
+            TypeError: Raised upon invalid input types.
+            ValueError: Raised upon invalid input values.
+        """
+        positions = self._reservoir_positions(count, seed, workers)
+        return [self._scenarios_of(x) for x in positions]
+
+    @staticmethod
+    def sample_key(seed, position):
+        """ The key of a testcase in a reservoir sample.
+
+        Args:
+            seed (int): The seed of the keys.
+            position (int): The position of the testcase.
+
+        Returns:
+            int: A 64-bits key.
+        """
+        digest = blake2b(f'{seed}-{position}'.encode(), digest_size=8)
+        return int.from_bytes(digest.digest(), 'big')
+
+    def _reservoir_positions(self, count, seed, workers):
+        """ Draw positions of testcases for `reservoir_sample`.
+
+        Args:
+            count (int): The number of positions to draw.
+            seed (int): The seed of the keys.
+            workers (int): The number of processes to use.
+
+        Returns:
+            list(int): The positions, in increasing order.
+
+        Raises:
+            TypeError: Raised upon invalid input types.
+            ValueError: Raised upon invalid input values.
+        """
+        ok = isinstance(count, int)
+        ok &= isinstance(seed, int)
+        ok &= isinstance(workers, int)
+        if not ok:
+            message = 'Bad input types.'
+            self.logger.error(f'TypeError: {message}')
+            raise TypeError(message)
+        if count < 0 or workers <= 0:
+            message = 'Bad input values.'
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
+
+        start, end = self.machine_range
+        if workers == 1:
+            reservoirs = [self._reservoir(start, end, count, seed)]
+        else:
+            queue, jobs = Queue(), []
+            for i in range(workers):
+                p = Process(
+                    target=self._reservoir,
+                    args=(
+                        *self._split(start, end, workers, i),
+                        count,
+                        seed,
+                        queue
+                    )
+                )
+                jobs.append(p)
+                p.start()
+            reservoirs = [queue.get() for _ in jobs]
+            [p.join() for p in jobs]
+
+        merged = nsmallest(count, (x for y in reservoirs for x in y))
+        return sorted(position for _, position in merged)
+
+    def _reservoir(self, start, end, count, seed, queue=None):
+        """ Used by a single process to keep the `count` testcases in
+        [start, end) accepted by the filter with the smallest keys.
+
+        Args:
+            start (int): The position of the first testcase.
+            end (int): The position after the last testcase.
+            count (int): The size of the reservoir.
+            seed (int): The seed of the keys.
+            queue (Queue, optional): If provided, the reservoir is put in the
+                queue rather than returned. Defaults to None.
+
+        Returns:
+            list(tuple): A list of (key, position).
+        """
+        # A `Filter` already runs during the generation of the testcases.
+        check = not isinstance(self.filter, Filter)
+        reservoir = []  # A heap of (-key, -position).
+        for testcase in self._iter_testcases(start, end):
+            if check and not self._accepts(testcase):
+                continue
+            position = self._position(testcase)
+            item = (-self.sample_key(seed, position), -position)
+            if len(reservoir) < count:
+                heappush(reservoir, item)
+            elif item > reservoir[0]:
+                heappushpop(reservoir, item)
+
+        reservoir = [(-key, -position) for key, position in reservoir]
+        if queue is None:
+            return reservoir
+        queue.put(reservoir)
+
+    def _check_range(self, start, end):
+        """ Check that [start, end) is a valid range of testcases.
+
+        Args:
+            start (int): The position of the first testcase.
+            end (int): The position after the last testcase.
+
+        Raises:
+            TypeError: Raised upon invalid input types.
+            ValueError: Raised upon invalid input values.
+        """
+        if not isinstance(start, int) or not isinstance(end, int):
+            message = 'Bad input types.'
+            self.logger.error(f'TypeError: {message}')
+            raise TypeError(message)
+
+        if not 0 <= start <= end <= self.space_length:
+            message = f'Invalid range of testcases [{start}, {end}).'
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
+
+    def _iter_testcases(self, start, end):
+        checks = [] if self._symmetry is None else [self._symmetry]
+        if isinstance(self.filter, Filter):
+            checks.append(FilterCheck(self, self.filter))
+        return self._walk(self.scenarios_length, start, end, checks)
+
+    def _walk(self, base, start, end, checks=()):
+        """ Generate the positions [start, end) of a space of testcases, in
+        the generator's ordering.
+
+        Each check is called round after round on the scenarios of the
+        testcase being generated (see `Symmetry.step`). As soon as a check
+        rejects the first rounds of a testcase, all the testcases starting
+        with the same rounds are skipped at once. The number of testcases
+        skipped by the checks is added to `pruned`.
+
+        Args:
+            base (int): The number of scenarios per round.
+            start (int): The position of the first testcase.
+            end (int): The position after the last testcase.
+            checks (list, optional): The checks selecting the testcases to
+                generate. Defaults to ().
+
+        Yields:
+            tuple(int): The index of the scenario of each round.
+        """
+        gray = self.ordering == 'gray'
+        rounds = self.number_of_rounds
+        digits = self._digits(start, base=base)
+        states = [[check.root() for check in checks]] + [None] * rounds
+        index, depth = start, 0
+        while index < end:
+            head = tuple(digits[:-1])
+            if gray:
+                head = self._to_gray(head, base)
+
+            # Check the first rounds, and skip all the testcases starting
+            # with the same rounds if they are rejected.
+            rejected = None
+            for i in range(depth, rounds-1) if checks else ():
+                states[i+1] = self._step(checks, states[i], head[i])
+                if states[i+1] is None:
+                    rejected = i
+                    break
+            if rejected is not None:
+                block = base ** (rounds - 1 - rejected)
+                skipped, index = index, (index // block + 1) * block
+                self.pruned += min(index, end) - skipped
+                previous, digits = digits, self._digits(index, base=base)
+                depth = next(
+                    (i for i in range(rounds) if previous[i] != digits[i]), 0
+                )
+                continue
+
+            # Iterate over the last round, then carry over to the others.
+            first = digits[-1]
+            last = min(base, first + end - index)
+            if gray and sum(head) % 2:
+                scenarios = range(base - 1 - first, base - 1 - last, -1)
+            else:
+                scenarios = range(first, last)
+            if checks:
+                for x in scenarios:
+                    if self._step(checks, states[-2], x) is not None:
+                        yield head + (x,)
+                    else:
+                        self.pruned += 1
+            else:
+                for x in scenarios:
+                    yield head + (x,)
+            index += last - first
+
+            digits[-1] = 0
+            i = len(digits) - 2
+            while i >= 0 and digits[i] == base - 1:
+                digits[i] = 0
+                i -= 1
+            if i >= 0:
+                digits[i] += 1
+            depth = max(i, 0)
+
+    @staticmethod
+    def _step(checks, states, scenario):
+        """ Run all checks on the scenario of the next round.
+
+        Args:
+            checks (list): The checks.
+            states (list): The state of each check after the previous rounds.
+            scenario (int): The index of the scenario of the next round.
+
+        Returns:
+            list: The new state of each check, or None if a check rejects the
+                scenario.
+        """
+        new_states = []
+        for check, state in zip(checks, states):
+            state = check.step(state, scenario)
+            if state is None:
+                return None
+            new_states.append(state)
+        return new_states
+
+    def _digits(self, index, rounds=None, base=None):
+        """ Write a testcase position in base `scenarios_length`.
 
+        Args:
+            index (int): The position of the testcase.
+            rounds (int, optional): The number of digits to write. Defaults
+                to the number of rounds.
+            base (int, optional): The base. Defaults to `scenarios_length`.
+
+        Returns:
+            list(int): The digits, most significant first.
+        """
+        rounds = self.number_of_rounds if rounds is None else rounds
+        base = self.scenarios_length if base is None else base
+        digits = [0] * rounds
+        for i in reversed(range(rounds)):
+            index, digits[i] = divmod(index, base)
+        return digits
+
+    def _scenarios_of(self, index):
+        """ Get the scenario of each round of the testcase at a specific
+        position, in the generator's ordering.
 
         Args:
-            generator (Generator): The generator instance.
-            testcases (iterable): The testcases to print.
-            filter (Object): A filter used to filter testcases before
-                printing them to file.
+            index (int): The position of the testcase.
 
         Returns:
-            str: A formatted json string ready to be printed to file.
+            tuple(int): The index of the scenario of each round.
         """
-        scenarios = []
-        for testcase in testcases:
-            if filter(testcase):
-                x, y = cls._format_scenario(generator, testcase)
-                scenarios += [{'round_leaders': x, 'round_partitions': y}]
+        digits = self._digits(index)
+        if self.ordering == 'gray':
+            return self._to_gray(digits, self.scenarios_length)
+        return tuple(digits)
 
-        return dumps({
-            'num_of_nodes': generator.number_of_nodes,
-            'num_of_twins': generator.f,
-            'scenarios': scenarios
-        })
+    @staticmethod
+    def _to_gray(digits, base):
+        """ Convert digits into the reflected mixed-radix Gray code.
 
-    @classmethod
-    def _format_scenario(cls, generator, testcase):
-        round_leaders, round_partitions = {}, {}
-        for round_number, scenario in enumerate(testcase):
-            leader, partition = scenario
-            leaders = [leader]
-            if leader in generator.target_nodes:
-                leaders.append(generator.get_twin(leader))
-            round_leaders[round_number+1] = leaders
-            round_partitions[round_number+1] = partition
-        return round_leaders, round_partitions
+        Args:
+            digits (list(int)): The digits, most significant first.
+            base (int): The base.
 
+        Returns:
+            tuple(int): The Gray code digits.
+        """
+        gray, parity = [], 0
+        for digit in digits:
+            digit = base - 1 - digit if parity else digit
+            gray.append(digit)
+            parity ^= digit & 1
+        return tuple(gray)
 
-class Generator:
-    def __init__(self, number_of_nodes, number_of_partitions, number_of_rounds,
-                 filter=None, folder_path='./', machine_index=1,
-                 number_of_machines=1):
-        """ Instantiate the generator.
+    @staticmethod
+    def _from_gray(gray, base):
+        """ Convert a reflected mixed-radix Gray code into digits. This is the
+        inverse of `_to_gray`.
 
         Args:
-            number_of_nodes (int): The number of nodes.
-            number_of_partitions (int): The number of partitions.
-            number_of_rounds (int): The number of rounds.
-            filter (Object, optional): A filter used to filter testcases before
-                printing them to file. Defaults to None.
-            folder_path (str, optional): The directory path where to print the
-                testcases. Defaults to './'.
-            machine_index (int, optional): The index of the machine on which
-                this generator instance is running. Defaults to 1.
-            number_of_machines (int, optional): The total number of machines
-                used to generate scenarios. Defaults to 1.
+            gray (list(int)): The Gray code digits.
+            base (int): The base.
+
+        Returns:
+            tuple(int): The digits, most significant first.
+        """
+        digits, parity = [], 0
+        for digit in gray:
+            digits.append(base - 1 - digit if parity else digit)
+            parity ^= digit & 1
+        return tuple(digits)
+
+    def scenario_matrix(self, start, end):
+        """ Get the testcases whose positions are in [start, end) as a NumPy
+        matrix of scenario indices.
+
+        Row i of the matrix is the testcase at position start+i, encoded as
+        in `iter_testcases` and in the generator's ordering. The matrix is
+        computed in a few vectorized steps: the positions are split into a
+        high part, common to the whole range up to one carry, and a low part
+        that fits into 64 bits and is converted with `numpy.unravel_index`.
+        This requires NumPy.
+
+        Args:
+            start (int): The position of the first testcase.
+            end (int): The position after the last testcase.
+
+        Returns:
+            numpy.ndarray: A matrix of shape (end-start, number_of_rounds).
 
         Raises:
+            ImportError: Raised if NumPy is not installed.
             TypeError: Raised upon invalid input types.
             ValueError: Raised upon invalid input values.
         """
-        self.logger = logging.getLogger(name='generator')
-
-        ok = isinstance(number_of_nodes, int)
-        ok &= isinstance(number_of_partitions, int)
-        ok &= isinstance(number_of_rounds, int)
-        ok &= isinstance(folder_path, str)
-        ok &= isinstance(machine_index, int)
-        ok &= isinstance(number_of_machines, int)
-        if not ok:
-            message = 'Bad input types.'
-            self.logger.error(f'TypeError: {message}')
-            raise TypeError(message)
+        if np is None:
+            message = 'The batch engine requires NumPy.'
+            self.logger.error(f'ImportError: {message}')
+            raise ImportError(message)
 
-        ok &= number_of_nodes > 0
-        ok &= number_of_partitions > 0
-        ok &= number_of_rounds > 0
-        ok &= machine_index > 0
-        ok &= number_of_machines >= machine_index
-        if not ok:
-            message = 'Bad input values.'
-            self.logger.error(f'ValueError: {message}')
-            raise ValueError(message)
+        self._check_range(start, end)
+        matrix = np.empty((end-start, self.number_of_rounds),
+                          dtype=self.scenario_dtype)
+        if start == end:
+            return matrix
 
-        self.number_of_nodes = number_of_nodes
-        self.number_of_partitions = number_of_partitions
-        self.number_of_rounds = number_of_rounds
-        self.folder_path = folder_path
-        self.machine_index = machine_index
-        self.number_of_machines = number_of_machines
-        self.filter = bool if filter is None else filter
+        base, rounds = self.scenarios_length, self.number_of_rounds
+        low_rounds = rounds
+        while low_rounds > 1 and base ** low_rounds > 1 << 61:
+            low_rounds -= 1
+        block = base ** low_rounds
 
-        self.f = (self.number_of_nodes - 1) // 3
-        self.nodes = [x for x in range(self.number_of_nodes+self.f)]
+        for batch in range(start, end, block):
+            high, low = divmod(batch, block)
+            offsets = np.arange(min(block, end-batch), dtype=np.int64) + low
+            carry = offsets >= block
+            offsets[carry] -= block
 
-        if len(self.nodes) < self.number_of_partitions:
-            message = (
-                'There should be at least as many nodes as partitions. '
-                f'Input: {len(self.nodes)} nodes and '
-                f'{self.number_of_partitions} partitions.'
+            rows = matrix[batch-start:batch-start+len(offsets)]
+            shape = (base,) * low_rounds
+            rows[:, rounds-low_rounds:] = np.stack(
+                np.unravel_index(offsets, shape), axis=1
             )
-            self.logger.error(f'ValueError: {message}')
-            raise ValueError(message)
+            if low_rounds < rounds:
+                heads = np.array([
+                    self._digits(high, rounds-low_rounds),
+                    self._digits(high+1, rounds-low_rounds)
+                ], dtype=matrix.dtype)
+                rows[:, :rounds-low_rounds] = heads[carry.astype(np.intp)]
 
-        if self.testcases_length > 1000000000:
-            self.logger.warning(
-                'Running the generator with these configurations will '
-                'generate more than 1 billion testcases.'
-            )
+        if self.ordering == 'gray':
+            parity = np.zeros(len(matrix), dtype=bool)
+            for column in matrix.T:
+                column[parity] = base - 1 - column[parity]
+                parity ^= (column & 1).astype(bool)
+        return matrix
 
-        self.logger.info(self.__repr__())
+    def iter_scenario_matrices(self, start, end, batch_size=100000):
+        """ Generate the testcases whose positions are in [start, end) as
+        NumPy matrices of scenario indices, one batch at a time.
+
+        Args:
+            start (int): The position of the first testcase.
+            end (int): The position after the last testcase.
+            batch_size (int, optional): The maximum number of testcases per
+                batch. Defaults to 100000.
+
+        Yields:
+            tuple: The position of the first testcase of the batch, and the
+                batch as returned by `scenario_matrix`.
+        """
+        for batch in range(start, end, batch_size):
+            yield batch, self.scenario_matrix(
+                batch, min(batch + batch_size, end)
+            )
 
     @property
-    def target_nodes(self):
-        """ The list of nodes that have a twin.
+    def scenario_dtype(self):
+        """ The smallest NumPy unsigned integer type that can hold any
+        scenario index. This requires NumPy.
 
         Returns:
-            list(int): A list of nodes' indeces.
+            numpy.dtype: The type of the scenario indices.
         """
-        return self.nodes[:self.f]
+        for dtype in (np.uint16, np.uint32):
+            if self.scenarios_length <= np.iinfo(dtype).max + 1:
+                return np.dtype(dtype)
+        return np.dtype(np.uint64)
 
-    @property
-    def testcases_length(self):
-        """ Forecast the total number of testcases.
+    def index_of(self, testcase):
+        """ Get the position of a testcase in the testcases space.
+
+        This is the inverse of `testcase_at`.
+
+        Args:
+            testcase (tuple): A tuple of (leader, partition), one per round.
 
         Returns:
-            int: The total number of testcases.
+            int: The position of the testcase, in [0, space_length).
+
+        Raises:
+            ValueError: Raised upon invalid input values.
         """
-        total = self.S(len(self.nodes), self.number_of_partitions)
-        total *= len(self.target_nodes)
-        total **= self.number_of_rounds
-        return total
+        return self._position(self.encode(testcase))
 
-    def __repr__(self):
-        twins_configs = (
-            f'(number of nodes: {self.number_of_nodes}, '
-            f'number of partitions: {self.number_of_partitions}, '
-            f'number of rounds: {self.number_of_rounds})'
-        )
-        return f'''Generator instantiated with the following settings:
-            \t Twins configs: {twins_configs}
-            \t output directory: {self.folder_path}
-            \t machine #: {self.machine_index}/{self.number_of_machines}'''
+    def _position(self, scenarios):
+        """ Same as `index_of`, but takes a testcase encoded as a tuple of
+        scenario indices.
+        """
+        if self.ordering == 'gray':
+            scenarios = self._from_gray(scenarios, self.scenarios_length)
+        index = 0
+        for scenario in scenarios:
+            index = index * self.scenarios_length + scenario
+        return index
 
-    def get_twin(self, node):
-        """ Get the twin of a specific node.
+    def encode(self, testcase):
+        """ Encode a testcase as a tuple of scenario indices.
+
+        The index of the scenario (leader, partition) is its position in
+        `combine_partitions_with_leaders`, ie.
+        `index_of_partition(partition) * len(target_nodes) + leader_index`.
+        This is the compact form in which testcases move through the
+        generator; they are only decoded by the output formats.
 
         Args:
-            node (int): The index of the node for which to return the twin.
+            testcase (tuple): A tuple of (leader, partition), one per round.
 
         Returns:
-            int: A node's index.
+            tuple(int): The index of the scenario of each round.
+
+        Raises:
+            ValueError: Raised upon invalid input values.
         """
-        assert node in self.target_nodes
-        return self.nodes[self.number_of_nodes+node]
+        leaders = len(self.target_nodes)
+        try:
+            assert len(testcase) == self.number_of_rounds
+            return tuple(
+                self.index_of_partition(partition) * leaders
+                + self.target_nodes.index(leader)
+                for leader, partition in testcase
+            )
+        except (AssertionError, TypeError, ValueError):
+            message = f'Not a valid testcase: {testcase}.'
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
 
-    def S(self, n, k):
-        """ Compute the Stirling numbers of the second kind.
+    def decode(self, testcase):
+        """ Decode a testcase encoded as a tuple of scenario indices.
+
+        This is the inverse of `encode`.
 
         Args:
-            n (int): Number of objects.
-            k (int): Number of non-empty subsets.
+            testcase (tuple(int)): The index of the scenario of each round.
 
         Returns:
-            int: The Stirling numbers of the second kind.
+            tuple: A tuple of (leader, partition), one per round.
+
+        Raises:
+            ValueError: Raised upon invalid input values.
         """
-        assert isinstance(n, int) and isinstance(k, int)
-        assert n > 0 and k > 0 and n >= k
-        S = [(-1)**i * (f(k)//f(i)//f(k - i)) * (k-i)**n for i in range(k+1)]
-        return sum(S) // f(k)
+        ok = len(testcase) == self.number_of_rounds
+        ok &= all(
+            isinstance(x, int) and 0 <= x < self.scenarios_length
+            for x in testcase
+        )
+        if not ok:
+            message = f'Not a valid testcase: {testcase}.'
+            self.logger.error(f'ValueError: {message}')
+            raise ValueError(message)
 
-    def make_partitions(self):
-        """ Find all possible ways in which n nodes can be partitioned into k
-        partitions.
+        return self._decode(testcase)
 
-        This problems is known as "Stirling Number of the Second Kind".
-        "In combinatorics, the Stirling numbers of the second kind tell
-        us how many ways there are of dividing up a set of n objects
-        (all different, or at least all labeled) into k nonempty subsets."
+    def _decode(self, testcase):
+        return tuple(self._scenario(x) for x in testcase)
 
-        E.g. for n={0,1,2} and k=2, possible partition are:
-        [
-            [ [0,1], [2] ],
-            [ [0,2], [1] ],
-            [ [1,2], [0] ],
-            [ [2], [0,1] ],
-            ...
-        ]
+    def multiplicity(self, testcase):
+        """ Count the testcases equivalent to a testcase under the symmetry
+        of the generator (see `Symmetry`), including itself.
+
+        Args:
+            testcase (tuple): A tuple of (leader, partition), one per round.
 
         Returns:
-            list: All possible partitions.
+            int: The size of the class of the testcase.
+
+        Raises:
+            ValueError: Raised upon invalid input values.
         """
-        def stirling2(n, k):
-            """ Provides solutions of the Stirling Number of the Second Kind.
-
-            Args:
-                n (int): The number of objects.
-                k (int): The number of sets.
-
-            Returns:
-                list: All solutions of the Stirling number of the second kind.
-            """
-            assert n > 0 and k > 0
-            if k == 1:
-                return [[[x for x in range(n)]]]
-            elif k == n:
-                return [[[x] for x in range(n)]]
-            else:
-                s_n1_k1 = stirling2(n-1, k-1)
-                for i in range(len(s_n1_k1)):
-                    s_n1_k1[i].append([n-1])
+        testcase = self.encode(testcase)
+        if self._symmetry is None:
+            return 1
+        return self._symmetry.multiplicity(testcase)
 
-                tmp = stirling2(n-1, k)
-                k_s_n1_k = []
-                for _ in range(k):
-                    k_s_n1_k += deepcopy(tmp)
-                for i in range(len(tmp)*k):
-                    k_s_n1_k[i][i // len(tmp)] += [n-1]
+    def _annotations(self, testcase):
+        """ Extra information printed with a testcase.
 
-                return s_n1_k1 + k_s_n1_k
+        Args:
+            testcase (tuple(int)): The index of the scenario of each round.
 
-        return stirling2(len(self.nodes), self.number_of_partitions)
+        Returns:
+            dict: The extra fields of the testcase.
+        """
+        annotations = {}
+        if self._symmetry is not None:
+            multiplicity = self._symmetry.multiplicity(testcase)
+            annotations['multiplicity'] = multiplicity
+        if self.sampling == 'reservoir':
+            key = self.sample_key(self.seed, self._position(testcase))
+            annotations['sample_key'] = key
+        if self.sampling == 'stratified':
+            strata = {}
+            for round_number, scenario in enumerate(self._decode(testcase)):
+                sizes, largest = self.stratum_of(scenario)
+                strata[round_number+1] = {
+                    'block_sizes': list(sizes),
+                    'leader_in_largest_block': largest
+                }
+            annotations['round_strata'] = strata
+        return annotations
 
-    def combine_partitions_with_leaders(self, partitions):
-        """ Find all possible ways in which we can assign leaders to partitions.
+    def _accepts(self, testcase):
+        """ Check whether the filter accepts a testcase.
 
-        E.g. for l={0,1} leaders, n={0,1,2} nodes and k=2 partitions, possible
-        combinations are:
-        [
-            (0, [ [0,1], [2] ]),
-            (0, [ [0,2], [1] ]),
-            (1, [ [1,2], [0] ]),
-            (0, [ [2], [0,1] ]),
-            ...
-        ]
+        Args:
+            testcase (tuple(int)): The index of the scenario of each round.
+
+        Returns:
+            bool: Whether the testcase is accepted.
+        """
+        if isinstance(self.filter, Filter):
+            return all(
+                self.filter.accept_ids(self, testcase[:i+1])
+                for i in range(len(testcase))
+            )
+        if isinstance(self.filter, Expression):
+            return bool(self._evaluate(np.array([testcase]))[0])
+        return self.filter(self._decode(testcase))
+
+    def _evaluate(self, matrix):
+        """ Evaluate a filter expression (see `Expression`) on a matrix of
+        testcases.
 
         Args:
-            partitions (list): List of all partitions.
+            matrix (numpy.ndarray): The scenario indices of the testcases, of
+                shape (testcases, rounds).
 
-        Yields:
-            iterable: An iterator of tuples of (leader, partition)
+        Returns:
+            numpy.ndarray: Whether each testcase is accepted.
         """
-        for partition in partitions:
-            for leader in self.target_nodes:
-                yield (leader, partition)
+        features = np.asarray(self.scenario_features)
+        return self.filter.evaluate(features[matrix])
 
-    def combine_scenarios_with_rounds(self, scenarios):
-        """ Combine the input parition-leader scenarios with rounds.
+    def _select(self, start, end, sample=None):
+        """ Select the testcases in [start, end) accepted by a filter
+        expression, evaluating the expression on the whole range at once.
 
-        E.g. for l={0,1} leaders, n={0,1,2} nodes, k=2 partitions, and r=2
-        rounds, possible combinations are:
-        [
-            [(0, [ [0,1], [2] ]), (0, [ [0,1], [2] ])],
-            [(0, [ [0,1], [2] ]), (0, [ [0,2], [1] ])],
-            [(1, [ [1,2], [0] ]), (1, [ [1,2], [0] ])],
-            [(0, [ [2], [0,1] ]), (1, [ [1,2], [0] ])],
-            ...
-        ]
+        Args:
+            start (int): The position of the first testcase.
+            end (int): The position after the last testcase.
+            sample (list(int), optional): The positions of sampled testcases
+                (see `sample`). If provided, the testcases [start, end) of the
+                sample are selected instead. Defaults to None.
+
+        Returns:
+            iterable: The accepted testcases, encoded as tuples of scenario
+                indices.
+        """
+        if sample is not None:
+            testcases = map(self._scenarios_of, sample[start:end])
+        elif self._symmetry is not None:
+            testcases = self._iter_testcases(start, end)
+        else:
+            testcases = None
+            matrix = self.scenario_matrix(start, end)
+        if testcases is not None:
+            matrix = np.array(list(testcases), dtype=self.scenario_dtype)
+            matrix = matrix.reshape(-1, self.number_of_rounds)
+        return map(tuple, matrix[self._evaluate(matrix)].tolist())
+
+    def _shard(self, start, end, sample=None):
+        """ Select the testcases in [start, end) accepted by the filter, as
+        a matrix of scenario indices along with their positions. Without
+        symmetry, and unless the filter must see each testcase, the matrix
+        is built by the batch engine (see `scenario_matrix`) without going
+        through tuples.
 
         Args:
-            iterable: An iterator of tuples of (leader, partition).
+            start (int): The position of the first testcase.
+            end (int): The position after the last testcase.
+            sample (list(int), optional): The positions of sampled testcases
+                (see `sample`). If provided, the testcases [start, end) of the
+                sample are selected instead. Defaults to None.
 
         Returns:
-            iterable: An iterator of testcases.
+            tuple(numpy.ndarray): The scenario indices of the accepted
+                testcases, of shape (testcases, rounds), and their positions.
+        """
+        batch = self.filter is bool or isinstance(self.filter, Expression)
+        if sample is not None:
+            positions = np.array(sample[start:end], dtype=np.uint64)
+            testcases = [self._scenarios_of(x) for x in sample[start:end]]
+            if not batch:
+                accepted = [self._accepts(x) for x in testcases]
+                positions = positions[np.array(accepted, dtype=bool)]
+                testcases = list(compress(testcases, accepted))
+        elif self._symmetry is None and batch:
+            positions = np.arange(start, end, dtype=np.uint64)
+            testcases = None
+            matrix = self.scenario_matrix(start, end)
+        else:
+            testcases = list(self._iter_testcases(start, end))
+            if not batch and not isinstance(self.filter, Filter):
+                testcases = [
+                    x for x in testcases if self.filter(self._decode(x))
+                ]
+            positions = np.array(
+                [self._position(x) for x in testcases], dtype=np.uint64
+            )
+        if testcases is not None:
+            matrix = np.array(testcases, dtype=self.scenario_dtype)
+            matrix = matrix.reshape(-1, self.number_of_rounds)
+        if isinstance(self.filter, Expression):
+            accepted = self._evaluate(matrix)
+            matrix, positions = matrix[accepted], positions[accepted]
+        return matrix, positions
+
+    def _stream(self, start, end, sample=None, batch_size=100000):
+        """ Generate the testcases in [start, end) accepted by the filter.
+
+        Args:
+            start (int): The position of the first testcase.
+            end (int): The position after the last testcase.
+            sample (list(int), optional): The positions of sampled testcases
+                (see `sample`). If provided, the testcases [start, end) of the
+                sample are generated instead. Defaults to None.
+            batch_size (int, optional): The number of testcases on which a
+                filter expression is evaluated at once. Defaults to 100000.
+
+        Yields:
+            tuple(int): The accepted testcases, encoded as tuples of scenario
+                indices.
         """
-        return product(scenarios, repeat=self.number_of_rounds)
+        if isinstance(self.filter, Expression):
+            for batch in range(start, end, batch_size):
+                yield from self._select(
+                    batch, min(batch + batch_size, end), sample
+                )
+        elif sample is not None:
+            testcases = map(self._scenarios_of, sample[start:end])
+            yield from (x for x in testcases if self._accepts(x))
+        elif self.filter is bool or isinstance(self.filter, Filter):
+            # A `Filter` runs during the generation of the testcases.
+            yield from self._iter_testcases(start, end)
+        else:
+            testcases = self._iter_testcases(start, end)
+            yield from (x for x in testcases if self.filter(self._decode(x)))
+
+    def _shards(self, start, end, size, sample=None):
+        """ Generate the testcases in [start, end) accepted by the filter as
+        matrices of scenario indices (see `_shard`).
+
+        Args:
+            start (int): The position of the first testcase.
+            end (int): The position after the last testcase.
+            size (int): The number of testcases of each matrix (but the last
+                one).
+            sample (list(int), optional): The positions of sampled testcases
+                (see `sample`). If provided, the testcases [start, end) of the
+                sample are generated instead. Defaults to None.
+
+        Yields:
+            tuple(numpy.ndarray): The scenario indices of the testcases, of
+                shape (testcases, rounds), and their positions.
+        """
+        batch = self.filter is bool or isinstance(self.filter, Expression)
+        if sample is not None or self._symmetry is not None or not batch:
+            testcases = self._stream(start, end, sample)
+            for first in testcases:
+                chunk = [first] + list(islice(testcases, size - 1))
+                matrix = np.array(chunk, dtype=self.scenario_dtype)
+                positions = np.array(
+                    [self._position(x) for x in chunk], dtype=np.uint64
+                )
+                yield matrix.reshape(-1, self.number_of_rounds), positions
+            return
+
+        matrices, indices, rows = [], [], 0
+        for batch_start in range(start, end, size):
+            matrix, positions = self._shard(
+                batch_start, min(batch_start + size, end)
+            )
+            matrices.append(matrix)
+            indices.append(positions)
+            rows += len(matrix)
+            if rows >= size:
+                matrix = np.concatenate(matrices)
+                positions = np.concatenate(indices)
+                whole = rows - rows % size
+                for i in range(0, whole, size):
+                    yield matrix[i:i+size], positions[i:i+size]
+                matrices, indices = [matrix[whole:]], [positions[whole:]]
+                rows -= whole
+        if rows:
+            yield np.concatenate(matrices), np.concatenate(indices)
 
-    def _print(self, testcases, process_id, dryrun, testcases_per_file):
+    def _print(self, start, end, process_id, dryrun, testcases_per_file,
+               sample=None, queue=None):
         """ Used by a single process print testcases to files.
 
         Args:
-            testcases (iterable): An iterator of testcases.
+            start (int): The position of the first testcase to print.
+            end (int): The position after the last testcase to print.
             process_id (int): The processe id.
             dryrun (bool): Whether dryrun mode is enabled.
             testcases_per_file (int, optional): The maximum number of testcases
                 that can be printing int a single file.
+            sample (list(int), optional): The positions of sampled testcases
+                (see `sample`). If provided, the testcases [start, end) of the
+                sample are printed instead. Defaults to None.
+            queue (Queue, optional): If provided, the number of pruned
+                testcases (see `pruned`) is put in the queue. Defaults to
+                None.
         """
-        chunks = ichunked(testcases, testcases_per_file)
-        for i, chunk in enumerate(chunks):
-            basename = f'testcase-{self.machine_index}-{process_id}'
-            filename = f'tmp-{basename}' if dryrun else f'{basename}-{i}'
-            #data = [RawFormat.make(self, x) for x in chunk if self.filter(x)]
-            data = JSONFormat.make(self, chunk, self.filter)
-            with open(join(self.folder_path, filename), 'a') as f:
-                f.write(data)
+        # Files are cut by number of printed testcases, and only opened
+        # once they get a testcase.
+        self.pruned = 0
+        basename = f'testcase-{self.machine_index}-{process_id}'
+        if self.output_format == 'npy':
+            shards = self._shards(start, end, testcases_per_file, sample)
+            for i, shard in enumerate(shards):
+                filename = f'tmp-{basename}' if dryrun else f'{basename}-{i}'
+                NpyFormat.save(join(self.folder_path, filename), *shard)
+        else:
+            formatter = self.FORMATS[self.output_format]
+            testcases = self._stream(start, end, sample)
+            for i, first in enumerate(testcases):
+                chunk = chain(
+                    (first,), islice(testcases, testcases_per_file - 1)
+                )
+                filename = f'tmp-{basename}' if dryrun else f'{basename}-{i}'
+                path = join(self.folder_path, filename)
+                mode = formatter.MODE
+                with open(path, mode, buffering=self.WRITE_BUFFER_SIZE) as f:
+                    formatter.write(self, chunk, bool, f)
+        if sample is None:
+            self.logger.debug(
+                f'Process {process_id} pruned {self.pruned} of the '
+                f'{end - start} testcases in [{start}, {end}).'
+            )
+        if queue is not None:
+            queue.put(self.pruned)
 
-    def print(self, testcases, dryrun, workers, testcases_per_file):
+    def print(self, start, end, dryrun, workers, testcases_per_file,
+              sample=None):
         """ Multiprocess print testcases to files.
 
+        Each process generates and prints its own contiguous share of the
+        testcases in [start, end). The testcases pruned by all the processes
+        are counted in `pruned`.
+
         Args:
-            testcases (iterable): An iterator of testcases.
+            start (int): The position of the first testcase to print.
+            end (int): The position after the last testcase to print.
             dryrun (bool): Whether dryrun mode is enabled.
             workers (int): The number of processes to create.
             testcases_per_file (int, optional): The maximum number of testcases
                 that can be printing int a single file.
+            sample (list(int), optional): The positions of sampled testcases
+                (see `sample`). If provided, the testcases [start, end) of the
+                sample are printed instead. Defaults to None.
         """
-        chunks = distribute(workers, testcases)
-        jobs = []
+        queue, jobs = Queue(), []
         for i in range(workers):
+            if sample is None:
+                share = self._split(start, end, workers, i)
+            else:
+                share = self._split_evenly(start, end, workers, i)
             p = Process(
                 target=self._print,
-                args=(chunks[i], i, dryrun, testcases_per_file)
+                args=(
+                    *share,
+                    i,
+                    dryrun,
+                    testcases_per_file,
+                    sample,
+                    queue
+                )
             )
             jobs.append(p)
             p.start()
+        self.pruned = sum(queue.get() for _ in jobs)
         [p.join() for p in jobs]
 
-    def run(self, dryrun=False, workers=1, testcases_per_file=1000):
+    def _split(self, start, end, parts, index):
+        """ Split a range of testcases into contiguous ranges of (almost)
+        equal size. With a `RoundFilter` (and no symmetry), the ranges hold
+        (almost) the same number of testcases accepted by the filter instead.
+
+        Args:
+            start (int): The position of the first testcase.
+            end (int): The position after the last testcase.
+            parts (int): The number of ranges.
+            index (int): The index of the range to return, in [0, parts).
+
+        Returns:
+            tuple(int): The positions [start, end) of the selected range.
+        """
+        if self._balanced and parts > 1:
+            # Split the testcases accepted by the filter instead.
+            first = self._accepted_before(start)
+            last = self._accepted_before(end)
+            bounds = [
+                self._position_of_accepted(
+                    first + (last - first) * x // parts, start, end
+                )
+                for x in (index, index + 1)
+            ]
+            return (
+                start if index == 0 else bounds[0],
+                end if index == parts - 1 else bounds[1]
+            )
+        return self._split_evenly(start, end, parts, index)
+
+    @staticmethod
+    def _split_evenly(start, end, parts, index):
+        """ Split a range into contiguous ranges of (almost) equal size.
+
+        Args:
+            start (int): The first element of the range.
+            end (int): The element after the last element of the range.
+            parts (int): The number of ranges.
+            index (int): The index of the range to return, in [0, parts).
+
+        Returns:
+            tuple(int): The selected range [start, end).
+        """
+        length = end - start
+        return (
+            start + length * index // parts,
+            start + length * (index + 1) // parts
+        )
+
+    def run(self, dryrun=False, workers=1, testcases_per_file=1000,
+            sample=None, seed=0, sampling='uniform'):
         """ Run the generator: generate all testcases and print them to files.
 
         Args:
@@ -331,10 +3777,24 @@ class Generator:
                 Defaults to 1.
             testcases_per_file (int, optional): The maximum number of testcases
                 that can be printing int a single file. Defaults to 1000.
+            sample (int, optional): If provided, only print this number of
+                testcases drawn at random. Defaults to None.
+            seed (int, optional): The seed used to draw the testcases when
+                `sample` is provided. Defaults to 0.
+            sampling (str, optional): How to draw the testcases when `sample`
+                is provided. With 'uniform' (see `sample`) or 'stratified'
+                (see `stratified_sample`), each machine prints its own share
+                of the sample, and 'stratified' prints the stratum of each
+                round. With 'reservoir' (see `reservoir_sample`), each machine
+                prints a uniform sample of the accepted testcases of its own
+                range, along with their keys. Defaults to 'uniform'.
         """
         ok = isinstance(dryrun, bool)
         ok &= isinstance(workers, int)
         ok &= isinstance(testcases_per_file, int)
+        ok &= sample is None or isinstance(sample, int)
+        ok &= isinstance(seed, int)
+        ok &= isinstance(sampling, str)
         if not ok:
             message = 'Bad input types.'
             self.logger.error(f'TypeError: {message}')
@@ -342,13 +3802,17 @@ class Generator:
 
         ok &= workers > 0
         ok &= testcases_per_file > 0
+        ok &= sampling in self.SAMPLINGS
         if not ok:
             message = 'Bad input values.'
             self.logger.error(f'ValueError: {message}')
             raise ValueError(message)
+        if sample is not None:
+            self._check_count(sample, seed)
 
         self.logger.info(
-            f'Generating {self.testcases_length} testcases...'
+            f'Generating {self.testcases_length if sample is None else sample}'
+            ' testcases...'
         )
 
         # Make partitions
@@ -357,55 +3821,89 @@ class Generator:
             f'nodes can be partitioned into {self.number_of_partitions} '
             'partitions...'
         )
-        partitions = self.make_partitions()
+        partitions = self.S(len(self.nodes), self.number_of_partitions)
         self.logger.debug(
             f'{self.number_of_nodes} nodes can be partitioned into '
-            f'{self.number_of_partitions} partitions in '
-            f'{self.S(len(self.nodes), self.number_of_partitions)} ways.'
+            f'{self.number_of_partitions} partitions in {partitions} ways.'
         )
 
         # Combine partitions with leaders
         self.logger.debug(
-            'STEP 2. Finding all possible ways in which '
-            f'{self.S(len(self.nodes), self.number_of_partitions)} partitions '
-            f'can be combined with {len(self.target_nodes)} leaders...'
-        )
-        scenarios = self.combine_partitions_with_leaders(partitions)
-        self.logger.debug(
-            f'{self.S(len(self.nodes), self.number_of_partitions)} partitions '
-            f'can be combined with {len(self.target_nodes)} leaders in '
-            f'{int(self.testcases_length**(1/self.number_of_rounds))} '
-            f'possible ways.'
+            f'STEP 2. {partitions} partitions can be combined with '
+            f'{len(self.target_nodes)} leaders in {self.scenarios_length} '
+            'possible ways, and these parition-leader scenarios can be '
+            f'combined with {self.number_of_rounds} rounds in '
+            f'{self.space_length} possible ways.'
         )
+        if self._symmetry is not None:
+            self.logger.debug(
+                f'Up to symmetry ({", ".join(self.symmetry)}), there are '
+                f'{self.testcases_length} classes of equivalent testcases.'
+            )
+        # Counting the accepted testcases builds the tables of the filter,
+        # which are otherwise only needed to split the testcases.
+        if self._balanced and self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(
+                f'The filter accepts {self.filtered_length} testcases.'
+            )
 
-        # Combine the parition-leader scenarios from above with rounds
-        self.logger.debug(
-            'STEP 3. Finding all possible ways in which '
-            f'{int(self.testcases_length**(1/self.number_of_rounds))} '
-            'parition-leader scenarios combinations can be combined with '
-            f'{self.number_of_rounds} rounds...'
-        )
-        testcases = self.combine_scenarios_with_rounds(scenarios)
-        self.logger.debug(
-            f'{int(self.testcases_length**(1/self.number_of_rounds))} '
-            'parition-leader scenarios can be combined with '
-            f'{self.number_of_rounds} rounds in {self.testcases_length} '
-            'possible ways.'
-        )
+        # Select the testcases of this machine
+        positions = None
+        if sample is None:
+            start, end = self.machine_range
+            self.logger.debug(
+                f'STEP 3. Selecting testcases [{start}, {end}) for machine '
+                f'{self.machine_index}/{self.number_of_machines}...'
+            )
+        elif sampling == 'reservoir':
+            self.sampling, self.seed = sampling, seed
+            start, end = self.machine_range
+            self.logger.debug(
+                f'STEP 3. Drawing {sample} of the accepted testcases in '
+                f'[{start}, {end}) with seed {seed} for machine '
+                f'{self.machine_index}/{self.number_of_machines}...'
+            )
+            positions = self._reservoir_positions(sample, seed, workers)
+            start, end = 0, len(positions)
+        else:
+            self.sampling, self.seed = sampling, seed
+            if sampling == 'stratified':
+                positions = self._stratified_positions(sample, seed)
+            else:
+                positions = self._sample_positions(sample, seed)
+            start, end = self._split_evenly(
+                0, sample, self.number_of_machines, self.machine_index - 1
+            )
+            self.logger.debug(
+                f'STEP 3. Drawing {sample} testcases with seed {seed}, and '
+                f'selecting sampled testcases [{start}, {end}) for machine '
+                f'{self.machine_index}/{self.number_of_machines}...'
+            )
+
+        # Evaluate the filter on each scenario once, and build the tables of
+        # the symmetry, before starting the processes.
+        if isinstance(self.filter, RoundFilter):
+            _ = self.round_verdicts
+        if self._symmetry is not None:
+            _ = self._symmetry._scenario_tables
 
         # Print the resulting testcases to files
         self.logger.debug(
-            f'Printing all testcases to file using {workers} processes...'
+            f'Printing testcases [{start}, {end}) to file using {workers} '
+            'processes...'
         )
-        testcases = distribute(self.number_of_machines, testcases)
         context_manager = TemporaryDirectory() if dryrun else nullcontext()
         with context_manager as directory:
             self.folder_path = self.folder_path if not dryrun else directory
+            if self.output_format == 'table':
+                TableFormat.write_table(self)
             self.print(
-                testcases[self.machine_index-1],
-                dryrun,
-                workers,
-                testcases_per_file
+                start, end, dryrun, workers, testcases_per_file, positions
+            )
+        if sample is None:
+            self.logger.info(
+                f'The checks pruned {self.pruned} of the {end - start} '
+                f'testcases in [{start}, {end}).'
             )
 
         self.logger.info(f'Finished.')
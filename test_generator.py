@@ -1,8 +1,12 @@
-from generator import Generator
+from generator import Generator, JSONFormat, TableFormat, BinaryFormat, \
+    BinaryReader, NpyFormat, Symmetry, Filter, RoundFilter, FeatureFilter, \
+    Expression, rounds
 import pytest
 import builtins
 from unittest.mock import patch, mock_open, MagicMock
 from math import ceil
+from json import loads, dumps
+from io import StringIO
 
 
 @pytest.fixture
@@ -65,6 +69,65 @@ def test_make_partitions():
     ]
 
 
+def test_make_partitions_rgs_order(partitions):
+    gen = Generator(4, 2, 8)
+    rgs = gen.make_partitions('rgs')
+    assert rgs[:4] == [
+        [[0, 1, 2, 3], [4]],
+        [[0, 1, 2, 4], [3]],
+        [[0, 1, 2], [3, 4]],
+        [[0, 1, 3, 4], [2]],
+    ]
+    assert sorted(rgs) == sorted(partitions)
+
+
+def test_iter_partitions():
+    gen = Generator(7, 3, 1)
+    for order in ['legacy', 'rgs']:
+        iterator = gen.iter_partitions(order)
+        assert next(iterator) != next(iterator)
+        assert len(list(iterator)) + 2 == gen.S(len(gen.nodes), 3)
+
+
+def test_iter_partitions_input_value_error(gen):
+    with pytest.raises(ValueError):
+        gen.iter_partitions('sorted')
+
+
+def test_partition_at():
+    gen = Generator(7, 3, 1)
+    for index, partition in enumerate(gen.iter_partitions()):
+        assert gen.partition_at(index) == partition
+        assert gen.index_of_partition(partition) == index
+
+
+def test_partition_at_input_error(gen, partitions):
+    with pytest.raises(TypeError):
+        gen.partition_at('a')
+    with pytest.raises(ValueError):
+        gen.partition_at(len(partitions))
+
+
+def test_index_of_partition_any_order(gen):
+    assert gen.index_of_partition([[4, 1, 3], [2, 0]]) == 13
+
+
+def test_index_of_partition_input_error(gen):
+    with pytest.raises(ValueError):
+        gen.index_of_partition([[0, 1, 2, 3, 4]])
+    with pytest.raises(ValueError):
+        gen.index_of_partition([[0, 1, 2], [2, 3, 4]])
+    with pytest.raises(ValueError):
+        gen.index_of_partition([[0, 1], [2, 3, 5]])
+
+
+def test_scenario_at(gen, partitions_with_leaders):
+    for index, scenario in enumerate(partitions_with_leaders):
+        assert gen.scenario_at(index) == scenario
+    with pytest.raises(ValueError):
+        gen.scenario_at(len(partitions_with_leaders))
+
+
 def test_combine_partitions_with_leaders(gen, partitions):
     scenarios = gen.combine_partitions_with_leaders(partitions)
     length = len(partitions) * len(gen.target_nodes)
@@ -81,17 +144,885 @@ def test_testcases_length(gen, testcases):
     assert len(testcases) == gen.testcases_length
 
 
-def test_print_process(gen, testcases):
+def test_testcase_at(gen, testcases):
+    for index, testcase in enumerate(testcases):
+        assert gen.testcase_at(index) == testcase
+
+
+def test_testcase_at_input_error(gen):
+    with pytest.raises(TypeError):
+        gen.testcase_at('a')
+    with pytest.raises(ValueError):
+        gen.testcase_at(gen.testcases_length)
+
+
+def test_index_of(gen, testcases):
+    for index, testcase in enumerate(testcases):
+        assert gen.index_of(testcase) == index
+
+
+def test_index_of_input_error(gen, testcases):
+    with pytest.raises(ValueError):
+        gen.index_of(testcases[0][:-1])
+    with pytest.raises(ValueError):
+        gen.index_of(((0, [[0, 1], [2, 3, 4, 5]]),) * gen.number_of_rounds)
+
+
+def test_iter_testcases(gen, testcases):
+    def decode(x): return [gen.decode(y) for y in x]
+    assert decode(gen.iter_testcases(0, len(testcases))) == testcases
+    assert decode(gen.iter_testcases(14, 47)) == testcases[14:47]
+    assert decode(gen.iter_testcases(5, 5)) == []
+
+
+def test_iter_testcases_input_error(gen):
+    with pytest.raises(TypeError):
+        gen.iter_testcases(0, 'a')
+    with pytest.raises(ValueError):
+        gen.iter_testcases(10, 5)
+
+
+def test_encode(gen, testcases):
+    for index, testcase in enumerate(testcases):
+        encoded = gen.encode(testcase)
+        assert all(isinstance(x, int) for x in encoded)
+        assert gen.decode(encoded) == testcase
+        assert gen.testcase_at(index) == gen.decode(encoded)
+
+
+def test_encode_input_error(gen):
+    with pytest.raises(ValueError):
+        gen.encode(((1, [[0, 1], [2, 3, 4]]),) * gen.number_of_rounds)
+
+
+def test_decode_input_error(gen):
+    with pytest.raises(ValueError):
+        gen.decode((0, 0))
+    with pytest.raises(ValueError):
+        gen.decode((0, 0, gen.scenarios_length))
+
+
+def test_scenario_matrix(gen):
+    pytest.importorskip('numpy')
+    for start, end in [(0, gen.testcases_length), (14, 47), (5, 5)]:
+        matrix = gen.scenario_matrix(start, end)
+        assert matrix.shape == (end - start, gen.number_of_rounds)
+        assert list(map(tuple, matrix.tolist())) == \
+            list(gen.iter_testcases(start, end))
+
+
+def test_scenario_matrix_large_space():
+    pytest.importorskip('numpy')
+    gen = Generator(4, 2, 20)
+    for start in [7 * 15**15 - 3, 123456789012345678901]:
+        matrix = gen.scenario_matrix(start, start + 10)
+        assert list(map(tuple, matrix.tolist())) == \
+            list(gen.iter_testcases(start, start + 10))
+
+
+def test_iter_scenario_matrices(gen):
+    np = pytest.importorskip('numpy')
+    batches = list(gen.iter_scenario_matrices(10, 3000, batch_size=1000))
+    assert [start for start, _ in batches] == [10, 1010, 2010]
+    matrix = np.concatenate([x for _, x in batches])
+    assert (matrix == gen.scenario_matrix(10, 3000)).all()
+
+
+def test_gray_ordering():
+    for gen in [Generator(4, 2, 3, ordering='gray'),
+                Generator(4, 4, 3, ordering='gray')]:
+        testcases = list(gen.iter_testcases(0, gen.testcases_length))
+        assert len(set(testcases)) == gen.testcases_length
+        for x, y in zip(testcases, testcases[1:]):
+            assert sum(a != b for a, b in zip(x, y)) == 1
+
+        scenarios = gen.combine_partitions_with_leaders(gen.make_partitions())
+        combined = gen.combine_scenarios_with_rounds(scenarios)
+        assert [gen.encode(x) for x in combined] == testcases
+
+
+def test_gray_ordering_random_access():
+    gen = Generator(4, 4, 3, ordering='gray')
+    testcases = list(gen.iter_testcases(0, gen.testcases_length))
+    for index, testcase in enumerate(testcases):
+        assert gen.encode(gen.testcase_at(index)) == testcase
+        assert gen.index_of(gen.decode(testcase)) == index
+    assert list(gen.iter_testcases(123, 456)) == testcases[123:456]
+
+
+def test_gray_ordering_scenario_matrix():
+    pytest.importorskip('numpy')
+    gen = Generator(4, 2, 20, ordering='gray')
+    start = 7 * 15**15 - 3
+    matrix = gen.scenario_matrix(start, start + 10)
+    assert list(map(tuple, matrix.tolist())) == \
+        list(gen.iter_testcases(start, start + 10))
+
+
+def test_make_generator_ordering_value_error():
+    with pytest.raises(ValueError):
+        _ = Generator(4, 2, 8, ordering='random')
+
+
+def test_symmetry_twins():
+    gen = Generator(4, 2, 3, symmetry='twins')
+    testcases = list(gen.iter_testcases(0, gen.space_length))
+    assert len(testcases) == gen.testcases_length < gen.space_length
+
+    def swap(testcase):
+        twin = {0: 4, 4: 0}
+        return gen.encode(tuple(
+            (leader, [[twin.get(x, x) for x in part] for part in partition])
+            for leader, partition in gen.decode(testcase)
+        ))
+    assert all(x <= swap(x) for x in testcases)
+    assert len({min(x, swap(x)) for x in testcases}) == len(testcases)
+
+    multiplicities = [gen.multiplicity(gen.decode(x)) for x in testcases]
+    assert sum(multiplicities) == gen.space_length
+    assert set(multiplicities) == {1, 2}
+
+
+def test_symmetry_sharding():
+    gen = Generator(7, 2, 2, symmetry='twins')
+    testcases = list(gen.iter_testcases(0, gen.space_length))
+    shards = []
+    for i in range(3):
+        shards += gen.iter_testcases(*gen._split(0, gen.space_length, 3, i))
+    assert shards == testcases
+    assert len(testcases) == gen.testcases_length
+
+
+def test_symmetry_honest():
+    gen = Generator(4, 2, 3, symmetry='honest')
+    testcases = list(gen.iter_testcases(0, gen.space_length))
+    assert len(testcases) == gen.testcases_length < gen.space_length
+
+    def relabel(testcase, permutation):
+        labels = dict(zip((1, 2, 3), permutation))
+        return gen.encode(tuple(
+            (leader, [[labels.get(x, x) for x in part] for part in partition])
+            for leader, partition in gen.decode(testcase)
+        ))
+    permutations = [
+        (1, 2, 3), (1, 3, 2), (2, 1, 3), (2, 3, 1), (3, 1, 2), (3, 2, 1)
+    ]
+    orbits = {min(relabel(x, y) for y in permutations) for x in testcases}
+    assert len(orbits) == len(testcases)
+
+    multiplicities = [gen.multiplicity(gen.decode(x)) for x in testcases]
+    assert sum(multiplicities) == gen.space_length
+
+
+def test_symmetry_twins_and_honest():
+    gen = Generator(7, 2, 2, symmetry=['honest', 'twins'])
+    assert gen.symmetry == ('twins', 'honest')
+    testcases = list(gen.iter_testcases(0, gen.space_length))
+    assert len(testcases) == gen.testcases_length
+    multiplicities = [gen.multiplicity(gen.decode(x)) for x in testcases]
+    assert sum(multiplicities) == gen.space_length
+    assert all(4 * 2 * 3 * 4 * 5 % x == 0 for x in multiplicities)
+
+
+def test_symmetry_leaders():
+    gen = Generator(7, 3, 1, symmetry='leaders')
+    testcases = list(gen.iter_testcases(0, gen.space_length))
+    assert len(testcases) == gen.testcases_length
+    assert gen.space_length / 2 <= len(testcases) < gen.space_length / 1.9
+
+    def relabel(testcase):
+        labels = {0: 1, 1: 0, 7: 8, 8: 7}
+        return gen.encode(tuple(
+            (labels[leader],
+             [[labels.get(x, x) for x in part] for part in partition])
+            for leader, partition in gen.decode(testcase)
+        ))
+    assert all(x <= relabel(x) for x in testcases)
+
+    multiplicities = [gen.multiplicity(gen.decode(x)) for x in testcases]
+    assert sum(multiplicities) == gen.space_length
+
+
+def test_symmetry_honest_large_space():
+    gen = Generator(10, 2, 2, symmetry=['twins', 'honest'])
+    testcases = gen.iter_testcases(0, gen.space_length)
+    for _ in range(10):
+        testcase = next(testcases)
+        assert gen._symmetry.order % gen._symmetry.multiplicity(testcase) == 0
+
+
+def test_symmetry_count_large_space():
+    gen = Generator(10, 3, 6, symmetry=Symmetry.GROUPS)
+    count = gen.testcases_length
+    assert gen.space_length // (8 * 6 * 5040) < count < gen.space_length
+
+
+def test_symmetry_fixed_partitions():
+    gen = Generator(7, 3, 1)
+    permutation = [1, 2, 0, 4, 3, 5, 6, 7, 8]
+    fixed = sum(
+        sorted(sorted(permutation[x] for x in part) for part in partition)
+        == partition
+        for partition in gen.iter_partitions()
+    )
+    cycles = Symmetry._cycles(permutation)
+    assert sorted(cycles) == [1, 1, 1, 1, 2, 3]
+    assert Symmetry.fixed_partitions(cycles, 3) == fixed
+
+
+def test_json_format(gen, testcases):
+    gen.sampling = 'stratified'
+    data = JSONFormat.make(gen, gen.iter_testcases(0, 3375), bool)
+    expected = []
+    for encoded, testcase in zip(gen.iter_testcases(0, 3375), testcases):
+        scenario = {'round_leaders': {}, 'round_partitions': {}}
+        for i, (leader, partition) in enumerate(testcase):
+            leaders = [leader, gen.get_twin(leader)]
+            scenario['round_leaders'][i+1] = leaders
+            scenario['round_partitions'][i+1] = partition
+        scenario.update(gen._annotations(encoded))
+        expected += [scenario]
+    assert data == dumps({
+        'num_of_nodes': 4, 'num_of_twins': 1, 'scenarios': expected
+    })
+    assert JSONFormat.make(gen, [], bool) == dumps({
+        'num_of_nodes': 4, 'num_of_twins': 1, 'scenarios': []
+    })
+
+
+def test_json_format_write(gen):
+    def testcases():
+        yield from gen.iter_testcases(0, 2)
+        raise RuntimeError
+
+    file = StringIO()
+    with pytest.raises(RuntimeError):
+        JSONFormat.write(gen, testcases(), bool, file)
+    expected = JSONFormat.make(gen, gen.iter_testcases(0, 2), bool)
+    assert file.getvalue() == expected[:-2]
+
+
+def test_table_format(tmp_path):
+    gen = Generator(
+        7, 2, 2, folder_path=str(tmp_path), symmetry=['twins'],
+        output_format='table'
+    )
+    TableFormat.write_table(gen)
+    table = loads((tmp_path / 'partitions.json').read_text())
+    assert table['leaders'] == [[0, 7], [1, 8]]
+    assert table['partitions'] == gen.make_partitions()
+    gen._print(0, 500, 0, False, 300)
+    testcases = list(gen.iter_testcases(0, 500))[:300]
+    expected = loads(JSONFormat.make(gen, testcases, bool))
+    path = str(tmp_path / 'testcase-1-0-0')
+    assert TableFormat.decode(path) == expected
+    assert TableFormat.decode(path, table) == expected
+
+
+def test_make_generator_output_format_error():
+    with pytest.raises(TypeError):
+        _ = Generator(4, 2, 8, output_format=1)
+    with pytest.raises(ValueError):
+        _ = Generator(4, 2, 8, output_format='xml')
+
+
+def test_binary_format(tmp_path):
+    gen = Generator(4, 2, 3, ordering='gray')
+    path = tmp_path / 'testcases'
+    path.write_bytes(BinaryFormat.make(gen, gen.iter_testcases(0, 500), bool))
+    assert path.stat().st_size == 16 + 500 * 3 * 2
+    with BinaryReader(str(path)) as reader:
+        assert (reader.number_of_nodes, reader.number_of_rounds) == (4, 3)
+        assert reader.ordering == 'gray'
+        assert len(reader) == 500
+        assert list(reader) == list(gen.iter_testcases(0, 500))
+        assert reader[123] == gen.encode(gen.testcase_at(123))
+        assert reader[-1] == gen.encode(gen.testcase_at(499))
+        assert reader.decode(7) == gen.testcase_at(7)
+        with pytest.raises(IndexError):
+            _ = reader[500]
+
+
+def test_binary_format_width():
+    assert BinaryFormat.width(1 << 16) == 2
+    assert BinaryFormat.width((1 << 16) + 1) == 4
+    assert BinaryFormat.width((1 << 32) + 1) == 8
+
+
+def test_binary_reader_input_error(tmp_path):
+    path = tmp_path / 'testcases'
+    path.write_bytes(b'{"num_of_nodes": 4}')
+    with pytest.raises(ValueError):
+        BinaryReader(str(path))
+    path.write_bytes(b'')
+    with pytest.raises(ValueError):
+        BinaryReader(str(path))
+
+
+def test_shard():
+    pytest.importorskip('numpy')
+    def filter(testcase): return len(testcase[0][1][0]) == 3
+    for gen in [
+        Generator(4, 2, 3, ordering='gray'),
+        Generator(4, 2, 3, symmetry=['twins']),
+        Generator(4, 2, 3, filter='rounds.any(leader_isolated)'),
+        Generator(4, 2, 3, filter=filter),
+        Generator(4, 2, 3, filter=LargeFirstPartition())
+    ]:
+        matrix, positions = gen._shard(100, 2600)
+        testcases = list(map(tuple, matrix.tolist()))
+        assert testcases == [
+            x for x in gen.iter_testcases(100, 2600) if gen._accepts(x)
+        ]
+        assert positions.tolist() == [gen._position(x) for x in testcases]
+    sample = gen._sample_positions(30, 1)
+    matrix, positions = gen._shard(0, 30, sample)
+    assert positions.tolist() == [
+        x for x in sample if gen._accepts(gen._scenarios_of(x))
+    ]
+
+
+def test_npy_format(tmp_path):
+    pytest.importorskip('numpy')
+    gen = Generator(4, 2, 3)
+    path = str(tmp_path / 'testcases')
+    NpyFormat.save(path, *gen._shard(0, 3375))
+    matrix, positions = NpyFormat.load(path)
+    assert matrix.shape == (3375, 3)
+    assert positions.tolist() == list(range(3375))
+    assert tuple(matrix[1234].tolist()) == gen.encode(gen.testcase_at(1234))
+    with pytest.raises(ValueError):
+        _ = Generator(7, 2, 8, output_format='npy')
+    with pytest.raises(ValueError):
+        _ = Generator(4, 20, 8, output_format='npy')
+
+
+def test_symmetry_json_format():
+    gen = Generator(4, 2, 2, symmetry=['twins'])
+    data = JSONFormat.make(gen, gen.iter_testcases(0, 15), bool)
+    assert [x['multiplicity'] for x in loads(data)['scenarios']] == [2] * 15
+
+
+def test_make_generator_symmetry_error():
+    with pytest.raises(TypeError):
+        _ = Generator(4, 2, 8, symmetry=1)
+    with pytest.raises(ValueError):
+        _ = Generator(4, 2, 8, symmetry='nodes')
+
+
+class LargeFirstPartition(Filter):
+    def accept_prefix(self, rounds):
+        return len(rounds[-1][1][0]) >= 3
+
+
+def test_filter(testcases):
+    gen = Generator(4, 2, 3, filter=LargeFirstPartition())
+    selected = [gen.decode(x) for x in gen.iter_testcases(0, 3375)]
+    assert selected == [x for x in testcases if gen.filter(x)]
+    assert gen.pruned == len(testcases) - len(selected)
+
+
+def test_filter_run_pruned(tmp_path):
+    gen = Generator(
+        4, 2, 3, filter=LargeFirstPartition(), folder_path=str(tmp_path)
+    )
+    gen.run(False, 3)
+    selected = sum(
+        len(loads(x.read_text())['scenarios'])
+        for x in tmp_path.glob('testcase-*')
+    )
+    assert gen.pruned == gen.space_length - selected > 0
+
+
+def test_filter_prunes_prefixes():
+    class FirstScenario(Filter):
+        calls = 0
+
+        def accept_prefix(self, rounds):
+            self.calls += 1
+            return rounds[-1] == gen.scenario_at(0)
+
+    gen = Generator(4, 2, 8, filter=FirstScenario())
+    assert list(gen.iter_testcases(0, gen.space_length)) == [(0,) * 8]
+    assert gen.pruned == gen.space_length - 1
+    assert gen.filter.calls == 8 * gen.scenarios_length
+
+
+def test_filter_json_format():
+    gen = Generator(4, 2, 2, filter=LargeFirstPartition())
+    data = JSONFormat.make(gen, gen.iter_testcases(0, 225), gen.filter)
+    assert len(loads(data)['scenarios']) == 10 ** 2
+
+
+def test_round_filter_count():
+    for ordering in Generator.ORDERINGS:
+        gen = Generator(4, 2, 3, ordering=ordering, filter=RoundFilter(
+            lambda x: len(x[1][0]) >= 3, lambda x, y: x[1] != y[1]
+        ))
+        testcases = list(gen.iter_testcases(0, gen.space_length))
+        assert gen.filtered_length == len(testcases) == 10 * 9 * 9
+        for index in [0, 17, 1234, gen.space_length]:
+            assert gen._accepted_before(index) == \
+                len(list(gen.iter_testcases(0, index)))
+        gen = Generator(4, 2, 3, ordering=ordering, filter=RoundFilter(
+            lambda x: len(x[1][0]) >= 3
+        ))
+        assert gen.filtered_length == 10 ** 3
+        for index in [0, 17, 1234, gen.space_length]:
+            assert gen._accepted_before(index) == \
+                len(list(gen.iter_testcases(0, index)))
+
+
+def test_round_filter_run_without_count():
+    gen = Generator(10, 3, 4, filter=RoundFilter(lambda x: x[0] == 0))
+    gen.run(True, 1, 100, sample=10)
+    assert gen._completions is None
+
+
+def test_round_filter_split():
+    gen = Generator(4, 2, 3, filter=RoundFilter(lambda x: x[1][0] == [0]))
+    shards = [gen.iter_testcases(*gen._split(0, 3375, 4, i)) for i in range(4)]
+    assert [len(list(x)) for x in shards] == [0, 0, 0, 1]
+    gen = Generator(4, 2, 3, filter=RoundFilter(lambda x: len(x[1][0]) > 3))
+    shards = [gen.iter_testcases(*gen._split(0, 3375, 3, i)) for i in range(3)]
+    assert [len(list(x)) for x in shards] == [21, 21, 22]
+
+
+def test_round_verdicts_cache(tmp_path):
+    calls = []
+
+    def predicate(scenario):
+        calls.append(scenario)
+        return len(scenario[1][0]) >= 3
+
+    def make(**kwargs):
+        filter = RoundFilter(predicate, **kwargs)
+        return Generator(4, 2, 3, filter=filter, cache_path=str(tmp_path))
+
+    gen = make(name='large first/block')
+    testcases = list(gen.iter_testcases(0, gen.space_length))
+    assert len(testcases) == 10 ** 3
+    assert len(calls) == gen.scenarios_length
+    assert [x.name for x in tmp_path.iterdir()] == [
+        'large_first_block-v0-n4-k2.verdicts'
+    ]
+
+    del calls[:]
+    gen = make(name='large first/block')
+    assert list(gen.iter_testcases(0, gen.space_length)) == testcases
+    assert gen.filtered_length == len(testcases)
+    assert calls == []
+
+    make(name='large first/block', version=1).round_verdicts
+    make().round_verdicts
+    assert len(calls) == 2 * gen.scenarios_length
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_filtered_length_input_error():
+    assert Generator(4, 2, 3).filtered_length == 3375
+    with pytest.raises(ValueError):
+        _ = Generator(4, 2, 3, filter=LargeFirstPartition()).filtered_length
+    with pytest.raises(ValueError):
+        _ = Generator(
+            4, 2, 3, filter=RoundFilter(), symmetry='twins'
+        ).filtered_length
+
+
+def test_sample():
+    gen = Generator(10, 3, 10)
+    testcases = list(gen.sample(100, seed=7))
+    assert testcases == list(Generator(10, 3, 10).sample(100, seed=7))
+    assert testcases != list(gen.sample(100, seed=8))
+    assert len(set(testcases)) == 100
+    assert testcases == sorted(testcases)
+    assert sorted(Generator(4, 2, 2).sample(225)) == \
+        sorted(Generator(4, 2, 2).iter_testcases(0, 225))
+
+
+def test_sample_input_error(gen):
+    with pytest.raises(TypeError):
+        gen.sample('a')
+    with pytest.raises(ValueError):
+        gen.sample(gen.space_length + 1)
+
+
+def test_strata(gen, partitions_with_leaders):
+    strata = [gen.stratum_of(x) for x in partitions_with_leaders]
+    assert sorted(set(strata)) == sorted(gen.strata)
+    assert gen.stratum_of((0, [[0], [1, 2, 3, 4]])) == ((4, 1), False)
+    assert gen.stratum_of((0, [[0, 1, 2], [3, 4]])) == ((3, 2), True)
+
+
+def test_stratified_sample():
+    gen = Generator(7, 3, 3)
+    testcases = list(gen.stratified_sample(130, seed=7))
+    assert testcases == list(Generator(7, 3, 3).stratified_sample(130, 7))
+    assert len(set(testcases)) == 130
+    for i in range(gen.number_of_rounds):
+        strata = [gen.stratum_of(gen.scenario_at(x[i])) for x in testcases]
+        assert sorted(strata) == sorted(gen.strata * 10)
+    with patch.object(Generator, '_sample_positions') as patcher:
+        assert len(list(gen.stratified_sample(5))) == 5
+        assert not patcher.called
+
+
+def test_stratified_sample_small_strata():
+    gen = Generator(4, 2, 1)
+    lengths = [gen._stratum_length(x) for x in gen.strata]
+    assert lengths == [4, 1, 6, 4]
+    testcases = list(gen.stratified_sample(10))
+    strata = [gen.stratum_of(gen.scenario_at(x[0])) for x in testcases]
+    assert sorted(strata.count(x) for x in gen.strata) == [1, 3, 3, 3]
+    assert len(list(gen.stratified_sample(gen.space_length))) == 15
+    gen = Generator(4, 2, 2)
+    assert len(set(gen.stratified_sample(gen.space_length))) == 225
+
+
+def test_stratified_sample_input_error(gen):
+    with pytest.raises(TypeError):
+        gen.stratified_sample(10, seed='a')
+    with pytest.raises(ValueError):
+        Generator(4, 2, 1).stratified_sample(16)
+
+
+def test_stratified_json_format():
+    gen = Generator(4, 2, 2)
+    gen.sampling = 'stratified'
+    data = loads(JSONFormat.make(gen, gen.stratified_sample(3), bool))
+    for scenario in data['scenarios']:
+        for number, stratum in scenario['round_strata'].items():
+            leader = scenario['round_leaders'][number][0]
+            partition = scenario['round_partitions'][number]
+            assert gen.stratum_of((leader, partition)) == (
+                tuple(stratum['block_sizes']),
+                stratum['leader_in_largest_block']
+            )
+
+
+def test_reservoir_sample():
+    def filter(testcase): return len(testcase[0][1][0]) == 3
+    gen = Generator(4, 2, 3, filter=filter)
+    accepted = [
+        gen.index_of(x) for x in gen.combine_scenarios_with_rounds(
+            gen.combine_partitions_with_leaders(gen.make_partitions())
+        ) if filter(x)
+    ]
+    expected = sorted(accepted, key=lambda x: gen.sample_key(5, x))[:20]
+    for workers in [1, 3]:
+        testcases = gen.reservoir_sample(20, seed=5, workers=workers)
+        assert [gen._position(x) for x in testcases] == sorted(expected)
+    assert len(gen.reservoir_sample(len(accepted) + 1)) == len(accepted)
+
+
+def test_reservoir_sample_input_error(gen):
+    with pytest.raises(TypeError):
+        gen.reservoir_sample(10, seed='a')
+    with pytest.raises(ValueError):
+        gen.reservoir_sample(10, workers=0)
+
+
+def test_print_process_sample(gen):
+    chunks = []
+
+    def write(generator, testcases, filter, file):
+        chunks.append(list(testcases))
+
+    positions = gen._sample_positions(30, 1)
+    with patch('builtins.open', mock_open()), \
+            patch('generator.JSONFormat.write', MagicMock(side_effect=write)):
+        gen._print(0, 15, 0, False, 10, positions)
+        gen._print(15, 30, 1, False, 10, positions)
+    assert [len(x) for x in chunks] == [10, 5, 10, 5]
+    assert sum(chunks, []) == list(gen.sample(30, 1))
+
+
+def test_scenario_features():
+    gen = Generator(7, 2, 1)
+    features = gen.scenario_features
+    assert len(features) == gen.scenarios_length
+    for index in range(gen.scenarios_length):
+        leader, partition = gen.scenario_at(index)
+        block = next(x for x in partition if leader in x)
+        mask = features[index]
+        assert mask >> gen.LEADER_BLOCK_SHIFT == len(block)
+        assert bool(mask & gen.feature_mask('leader_isolated')) == \
+            (set(block) <= {leader, gen.get_twin(leader)})
+        assert bool(mask & gen.feature_mask('quorum')) == any(
+            len({x % 7 for x in part}) >= 5 for part in partition
+        )
+
+
+def test_feature_mask_input_error():
+    with pytest.raises(ValueError):
+        Generator.feature_mask('leader_twin_split', 'twins')
+
+
+def test_feature_filter(testcases):
+    gen = Generator(4, 2, 3, filter=FeatureFilter(
+        required=['leader_in_largest_block'], forbidden=['twins_split']
+    ))
+    selected = [gen.decode(x) for x in gen.iter_testcases(0, 3375)]
+    assert len(selected) == 6 ** 3
+    assert selected == [
+        x for x in testcases
+        if all(0 in y[0] and 4 in y[0] and len(y[0]) >= len(y[1])
+               for _, y in x)
+    ]
+    with pytest.raises(TypeError):
+        gen.filter(testcases[0])
+    with pytest.raises(TypeError):
+        JSONFormat.make(gen, [gen.encode(testcases[0])], gen.filter)
+    assert [LargeFirstPartition()(x) for x in testcases[::100]] == [
+        all(len(y[1][0]) >= 3 for y in x) for x in testcases[::100]
+    ]
+
+
+def test_filter_expression():
+    pytest.importorskip('numpy')
+    gen = Generator(7, 2, 3, filter=(
+        'rounds.any(leader_isolated) | '
+        '(rounds.count(quorum) <= 1) & ~rounds.at(2, twins_split)'
+    ))
+    features = gen.scenario_features
+
+    def has(x, feature): return features[x] & gen.feature_mask(feature)
+    expected = [
+        x for x in gen.iter_testcases(50000, 150000)
+        if any(has(y, 'leader_isolated') for y in x)
+        or sum(bool(has(y, 'quorum')) for y in x) <= 1
+        and not has(x[2], 'twins_split')
+    ]
+    assert list(gen._select(50000, 150000)) == expected
+    assert all(gen._accepts(x) for x in expected[:100])
+
+
+def test_filter_expression_terms():
+    np = pytest.importorskip('numpy')
+    gen = Generator(4, 2, 2)
+    matrix = np.array([[0, 14], [3, 3]])
+    features = np.asarray(gen.scenario_features)[matrix]
+    size = Expression.feature('leader_block_size')
+    assert (size >= 4).evaluate(features).tolist() == [False, True]
+    assert rounds.count(size == 1).evaluate(features).tolist() == [1, 0]
+    expression = rounds.at(0, 'leader_in_largest_block') & ~rounds.all(
+        'leader_isolated'
+    )
+    assert expression.evaluate(features).tolist() == [True, True]
+
+
+def test_filter_expression_input_error():
+    with pytest.raises(ValueError):
+        Expression.parse('rounds.any(leader_twins)')
+    with pytest.raises(ValueError):
+        Expression.parse('1 < leader_block_size < 3')
+    with pytest.raises(ValueError):
+        Expression.parse('3')
+    with pytest.raises(ValueError):
+        Expression.parse('rounds.at(quorum, quorum)')
+    with pytest.raises(ValueError):
+        Expression.parse('rounds.any.__globals__')
+    with pytest.raises(ValueError):
+        Expression.parse(
+            "rounds.any.__globals__['__builtins__']['__import__']('os')"
+        )
+    with pytest.raises(ValueError):
+        Expression.parse('(lambda: 1)()')
+    with pytest.raises(ValueError):
+        Expression.parse('rounds.any(3)')
+    for text in [
+        'rounds.any(leader_isolated) & rounds.count(quorum) <= 2',
+        'leader_isolated & 3', '~leader_block_size', 'quorum == quorum',
+        'rounds.count(quorum)', 'rounds.any(leader_block_size)'
+    ]:
+        with pytest.raises(ValueError):
+            Expression.parse(text)
+    with pytest.raises(ValueError):
+        Generator(7, 2, 2, filter=(
+            'rounds.any(leader_isolated) & rounds.count(quorum) <= 2'
+        ))
+    with pytest.raises(ValueError):
+        Generator(4, 2, 2, filter='rounds.at(5, quorum)')
+    with pytest.raises(ValueError):
+        Generator(4, 2, 2, filter='rounds.at(-3, quorum)')
+    _ = Generator(4, 2, 2, filter='rounds.at(-2, quorum)')
+
+
+def test_estimate_selectivity(gen, testcases):
+    def filter(x): return len(x[0][1][0]) >= 4
+    gen.filter = filter
+    estimates = gen.estimate_selectivity(500, seed=1, testcases_per_file=100)
+    assert estimates['samples'] == 500
+    accepted = sum(filter(x) for x in testcases)
+    low, high = estimates['testcases_interval']
+    assert low <= accepted <= high
+    assert estimates['selectivity'] == estimates['accepted'] / 500
+    assert estimates['files'] == ceil(estimates['testcases'] / 100)
+
+    data = JSONFormat.make(gen, gen.iter_testcases(0, 3375), filter)
+    assert abs(estimates['bytes'] - len(data)) < 0.2 * len(data)
+
+
+def test_estimate_selectivity_symmetry():
+    gen = Generator(4, 2, 3, symmetry='honest')
+    estimates = gen.estimate_selectivity(3375)
+    assert estimates['testcases'] == gen.testcases_length
+
+
+@pytest.mark.parametrize('output_format', ['json', 'table', 'binary', 'npy'])
+def test_estimate_selectivity_formats(tmp_path, output_format):
+    if output_format == 'npy':
+        pytest.importorskip('numpy')
+    gen = Generator(
+        4, 2, 3, folder_path=str(tmp_path), output_format=output_format,
+        symmetry='twins'
+    )
+    estimates = gen.estimate_selectivity(3375, testcases_per_file=100)
+    gen.run(False, 1, testcases_per_file=100)
+    files = list(tmp_path.iterdir())
+    assert estimates['files'] == len(files)
+    assert estimates['bytes'] == sum(x.stat().st_size for x in files)
+
+
+def test_estimate_selectivity_machines(tmp_path):
+    def make(index, output_format):
+        path = tmp_path / f'{output_format}-{index}'
+        path.mkdir(exist_ok=True)
+        return Generator(
+            4, 2, 3, folder_path=str(path), output_format=output_format,
+            machine_index=index, number_of_machines=2
+        )
+
+    # 2 machines, with 3 processes each printing 562 or 563 testcases.
+    for output_format, length in [('json', 36), ('table', 38)]:
+        estimates = make(1, output_format).estimate_selectivity(
+            3375, testcases_per_file=100, workers=3
+        )
+        for index in (1, 2):
+            make(index, output_format).run(False, 3, testcases_per_file=100)
+        files = list(tmp_path.glob(f'{output_format}-*/*'))
+        assert estimates['files'] == len(files) == length
+        assert estimates['bytes'] == sum(x.stat().st_size for x in files)
+
+
+def test_estimate_selectivity_empty():
+    estimates = Generator(3, 2, 2).estimate_selectivity()
+    assert estimates['testcases'] == estimates['bytes'] == 0
+
+
+def test_estimate_selectivity_input_error(gen):
+    with pytest.raises(TypeError):
+        gen.estimate_selectivity('a')
+    with pytest.raises(ValueError):
+        gen.estimate_selectivity(0)
+
+
+def test_machine_range(testcases):
+    machines = 7
+    ranges = [Generator(4, 2, 3, machine_index=i+1,
+                        number_of_machines=machines).machine_range
+              for i in range(machines)]
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(testcases)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+
+
+def test_print_process(gen):
     with patch('builtins.open', mock_open()) as patcher:
-        gen._print(testcases, 1, True, 1000)
+        gen._print(0, gen.testcases_length, 1, True, 1000)
         number_of_files = ceil(gen.testcases_length / 1000)
         assert patcher.call_count == number_of_files
 
 
+def test_print_process_range(gen, testcases):
+    chunks = []
+
+    def write(generator, testcases, filter, file):
+        chunks.append([generator.decode(x) for x in testcases])
+
+    with patch('builtins.open', mock_open()), \
+            patch('generator.JSONFormat.write', MagicMock(side_effect=write)):
+        gen._print(100, 2600, 1, False, 1000)
+        assert chunks == [
+            testcases[100:1100], testcases[1100:2100], testcases[2100:2600]
+        ]
+
+
 def test_run(gen):
     gen.run(True, 1)
 
 
+def test_run_table_format(tmp_path):
+    gen = Generator(4, 2, 2, folder_path=str(tmp_path), output_format='table')
+    gen.run(False, 2, testcases_per_file=100)
+    files = sorted(tmp_path.glob('testcase-*'))
+    scenarios = sum(
+        (TableFormat.decode(str(x))['scenarios'] for x in files), []
+    )
+    assert len(scenarios) == gen.testcases_length
+
+
+def test_run_binary_format(tmp_path):
+    gen = Generator(4, 2, 2, folder_path=str(tmp_path), output_format='binary')
+    gen.run(False, 2, testcases_per_file=100)
+    testcases = []
+    for path in sorted(tmp_path.glob('testcase-*')):
+        with BinaryReader(str(path)) as reader:
+            testcases += list(reader)
+    assert sorted(testcases) == list(gen.iter_testcases(0, 225))
+
+
+def test_run_npy_format(tmp_path):
+    pytest.importorskip('numpy')
+    gen = Generator(4, 2, 2, folder_path=str(tmp_path), output_format='npy')
+    gen.run(False, 2, testcases_per_file=100)
+    positions = []
+    for path in tmp_path.glob('testcase-*-index.npy'):
+        path = str(path)[:-len('-index.npy')]
+        matrix, index = NpyFormat.load(path)
+        assert len(matrix) == len(index)
+        positions += index.tolist()
+    assert sorted(positions) == list(range(225))
+
+
+def test_run_filtered_files(tmp_path):
+    gen = Generator(
+        4, 2, 2, folder_path=str(tmp_path), symmetry=['twins', 'leaders']
+    )
+    gen.run(False, 1, testcases_per_file=10)
+    files = list(tmp_path.glob('testcase-*'))
+    sizes = [len(loads(x.read_text())['scenarios']) for x in files]
+    assert sum(sizes) == gen.testcases_length
+    assert len(files) == -(-gen.testcases_length // 10)
+    assert sorted(sizes)[1:] == [10] * (len(files) - 1)
+
+
+def test_run_npy_filtered_files(tmp_path):
+    pytest.importorskip('numpy')
+    gen = Generator(
+        4, 2, 2, folder_path=str(tmp_path), output_format='npy',
+        filter='rounds.any(leader_isolated)'
+    )
+    gen.run(False, 1, testcases_per_file=10)
+    sizes = []
+    for path in tmp_path.glob('testcase-*-index.npy'):
+        path = str(path)[:-len('-index.npy')]
+        sizes.append(len(NpyFormat.load(path)[1]))
+    accepted = sum(1 for x in gen.iter_testcases(0, 225) if gen._accepts(x))
+    assert sum(sizes) == accepted
+    assert sorted(sizes)[1:] == [10] * (len(sizes) - 1)
+
+
+def test_run_sample(gen):
+    gen.run(True, 2, sample=100, seed=3)
+    gen.run(True, 2, sample=20, seed=3, sampling='stratified')
+    gen.run(True, 2, sample=20, seed=3, sampling='reservoir')
+    with pytest.raises(ValueError):
+        gen.run(True, 1, sample=gen.space_length + 1)
+    with pytest.raises(ValueError):
+        gen.run(True, 1, sample=1, sampling='random')
+
+
 def test_run_type_input_type_error(gen):
     with pytest.raises(TypeError):
         gen.run(True, 'a')